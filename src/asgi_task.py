@@ -10,19 +10,58 @@
 
 
 import asyncio
+import hashlib
 import json
-import urllib.request
-from typing import Any, Dict
+import os
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import parse_qs
+
+import aiohttp
 
 API_URL_PATTERN = "https://api.exchangerate-api.com/v4/latest/{currency}"
 PROVIDER = "https://www.exchangerate-api.com"
 WARNING_UPGRADE_TO_V6 = "https://www.exchangerate-api.com/docs/free"
 TERMS = "https://www.exchangerate-api.com/terms"
 
+# Провайдер обновляет курсы раз в сутки (time_last_updated)
+DEFAULT_UPDATE_INTERVAL = 24 * 60 * 60
+# Минимальное время жизни записи: если провайдер прислал уже «просроченные» метки,
+# не долбим его на каждый запрос
+MIN_TTL = 60
+# Пауза перед повторной попыткой обновления после ошибки провайдера
+REFRESH_RETRY_DELAY = 30
+
+# Параметры пула соединений к провайдеру
+UPSTREAM_MAX_CONNECTIONS = 32
+UPSTREAM_CONNECT_TIMEOUT = 3
+UPSTREAM_READ_TIMEOUT = 5
+UPSTREAM_KEEPALIVE_TIMEOUT = 60
+
+# Режим кросс-курсов: все базы, кроме USD, считаются из одной таблицы USD,
+# так что один запрос к провайдеру покрывает все валюты
+CROSS_RATE_MODE = os.environ.get("CROSS_RATE_MODE", "0") == "1"
+CROSS_RATE_BASE = "USD"
+# Значащих цифр в производных курсах
+CROSS_RATE_PRECISION = 6
+
+# Пакетный запрос: /batch?bases=USD,EUR,GBP&symbols=JPY,CHF
+BATCH_PATH = "/batch"
+BATCH_MAX_BASES = 200
+BATCH_CONCURRENCY = 8
 
-async def app(scope: Dict, receive: Any, send: Any) -> None:
+
+async def app(scope: dict, receive: Any, send: Any) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
     assert scope["type"] == "http"
     path = scope.get("path", "/")
+    if path == BATCH_PATH:
+        await batch(scope, send)
+        return
     if not path or len(path) < 2:
         await send(
             {
@@ -47,7 +86,17 @@ async def app(scope: Dict, receive: Any, send: Any) -> None:
         await send({"type": "http.response.body", "body": b"Invalid currency code"})
         return
     try:
-        data = await fetch_exchange_rates(currency_code)
+        data = await get_rates(currency_code)
+    except UnknownCurrencyError:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 404,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"Unknown currency code"})
+        return
     except Exception as e:
         await send(
             {
@@ -63,6 +112,341 @@ async def app(scope: Dict, receive: Any, send: Any) -> None:
             }
         )
         return
+    rendered = render_rates(data)
+    if etag_matches(scope, rendered.etag):
+        # Клиент уже получил эту версию тела
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(b"etag", rendered.etag)],
+            }
+        )
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send(
+        {"type": "http.response.start", "status": 200, "headers": rendered.headers}
+    )
+    await send({"type": "http.response.body", "body": rendered.body})
+
+
+async def batch(scope: dict, send: Any) -> None:
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    bases = parse_currency_codes(params.get("bases", []))
+    symbols = parse_currency_codes(params.get("symbols", []))
+    error = None
+    if bases is None or symbols is None:
+        error = b"Invalid currency code"
+    elif not bases:
+        error = b"Currency codes required like /batch?bases=USD,EUR"
+    elif len(bases) > BATCH_MAX_BASES:
+        error = f"Too many bases, max {BATCH_MAX_BASES}".encode("utf-8")
+    if error is not None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 400,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+            }
+        )
+        await send({"type": "http.response.body", "body": error})
+        return
+
+    # Промахи грузятся параллельно, но не больше BATCH_CONCURRENCY за раз;
+    # одинаковые коды из разных запросов схлопываются в rates_cache
+    sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def load(code: str) -> tuple[str, dict[str, Any]]:
+        async with sem:
+            try:
+                data = await get_rates(code)
+            except UnknownCurrencyError:
+                return code, {"error": "Unknown currency code"}
+            except Exception as e:
+                return code, {"error": f"Failed to get rates from provider: {e}"}
+        rates = data["rates"]
+        if symbols:
+            rates = {symbol: rates[symbol] for symbol in symbols if symbol in rates}
+        return code, {
+            "base": data["base"],
+            "date": data["date"],
+            "time_last_updated": data["time_last_updated"],
+            "rates": rates,
+        }
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json; charset=utf-8")],
+        }
+    )
+    # Отдаём один JSON-объект, дописывая базы по мере готовности
+    head = json.dumps(
+        {
+            "provider": PROVIDER,
+            "WARNING_UPGRADE_TO_V6": WARNING_UPGRADE_TO_V6,
+            "terms": TERMS,
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    await send(
+        {
+            "type": "http.response.body",
+            "body": (head[:-1] + ',"results":{').encode("utf-8"),
+            "more_body": True,
+        }
+    )
+    separator = ""
+    for next_result in asyncio.as_completed([load(code) for code in bases]):
+        code, item = await next_result
+        chunk = separator + json.dumps(code) + ":"
+        chunk += json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+        separator = ","
+        await send(
+            {
+                "type": "http.response.body",
+                "body": chunk.encode("utf-8"),
+                "more_body": True,
+            }
+        )
+    await send({"type": "http.response.body", "body": b"}}"})
+
+
+def parse_currency_codes(values: list[str]) -> list[str] | None:
+    # Коды без повторов в порядке запроса; None, если есть невалидный код
+    codes = {}
+    for value in values:
+        for code in value.split(","):
+            code = code.strip().upper()
+            if not code:
+                continue
+            if not code.isalpha() or len(code) != 3:
+                return None
+            codes[code] = None
+    return list(codes)
+
+
+async def lifespan(receive: Any, send: Any) -> None:
+    # Пул соединений живёт столько же, сколько приложение
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await upstream.start()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await upstream.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+class UpstreamClient:
+    """
+    Неблокирующий клиент провайдера с постоянным keep-alive пулом соединений.
+
+    Число одновременных соединений ограничено лимитом коннектора,
+    остальные запросы ждут свободное соединение в event loop.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = UPSTREAM_MAX_CONNECTIONS,
+        connect_timeout: float = UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout: float = UPSTREAM_READ_TIMEOUT,
+        keepalive_timeout: float = UPSTREAM_KEEPALIVE_TIMEOUT,
+    ):
+        self._max_connections = max_connections
+        self._timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self._keepalive_timeout = keepalive_timeout
+        self._session: aiohttp.ClientSession | None = None
+
+    async def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self._max_connections,
+            limit_per_host=self._max_connections,
+            keepalive_timeout=self._keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector, timeout=self._timeout, raise_for_status=True
+        )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_json(self, url: str) -> Any:
+        if self._session is None or self._session.closed:
+            # Сервер запущен без lifespan (например, --lifespan off)
+            await self.start()
+        async with self._session.get(url) as resp:
+            return await resp.json(content_type=None)
+
+
+upstream = UpstreamClient()
+
+
+async def fetch_exchange_rates(currency_code: str) -> dict[str, Any]:
+    url = API_URL_PATTERN.format(currency=currency_code)
+    return await upstream.get_json(url)
+
+
+@dataclass
+class _CacheEntry:
+    data: dict[str, Any]
+    expires_at: float
+
+
+class RatesCache:
+    """
+    In-process кеш курсов по коду валюты.
+
+    Запись живёт до time_next_update (или time_last_updated + сутки).
+    Одновременные промахи по одному коду схлопываются в один запрос к провайдеру,
+    а просроченная запись отдаётся, пока в фоне идёт её обновление.
+    """
+
+    def __init__(
+        self,
+        fetcher: Callable[[str], Awaitable[dict[str, Any]]],
+        update_interval: float = DEFAULT_UPDATE_INTERVAL,
+        min_ttl: float = MIN_TTL,
+        retry_delay: float = REFRESH_RETRY_DELAY,
+    ):
+        self._fetcher = fetcher
+        self._update_interval = update_interval
+        self._min_ttl = min_ttl
+        self._retry_delay = retry_delay
+        self._entries: dict[str, _CacheEntry] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+        # Держим ссылки на фоновые задачи, иначе их может собрать GC
+        self._background: set[asyncio.Task] = set()
+
+    async def get(self, currency_code: str) -> dict[str, Any]:
+        entry = self._entries.get(currency_code)
+        if entry is None:
+            # Холодный промах: ждём (общий) запрос к провайдеру
+            return await asyncio.shield(self._load(currency_code))
+        if time.time() >= entry.expires_at:
+            # Stale-while-revalidate: отдаём старое значение, обновляем в фоне
+            task = self._load(currency_code)
+            if task not in self._background:
+                self._background.add(task)
+                task.add_done_callback(self._background_done)
+        return entry.data
+
+    def peek(self, currency_code: str) -> dict[str, Any] | None:
+        entry = self._entries.get(currency_code)
+        return entry.data if entry is not None else None
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        # Ошибка фонового обновления уже учтена в _refresh, просто забираем её
+        if not task.cancelled():
+            task.exception()
+
+    def _load(self, currency_code: str) -> asyncio.Task:
+        task = self._inflight.get(currency_code)
+        if task is None:
+            task = asyncio.create_task(self._refresh(currency_code))
+            self._inflight[currency_code] = task
+            task.add_done_callback(lambda _: self._inflight.pop(currency_code, None))
+        return task
+
+    async def _refresh(self, currency_code: str) -> dict[str, Any]:
+        try:
+            data = await self._fetcher(currency_code)
+        except Exception:
+            entry = self._entries.get(currency_code)
+            if entry is not None:
+                # Оставляем последнее удачное значение и откладываем повтор
+                entry.expires_at = time.time() + self._retry_delay
+            raise
+        self._entries[currency_code] = _CacheEntry(data, self._expires_at(data))
+        return data
+
+    def _expires_at(self, data: dict[str, Any]) -> float:
+        now = time.time()
+        expires_at = data.get("time_next_update")
+        if not isinstance(expires_at, (int, float)):
+            last_updated = data.get("time_last_updated")
+            if isinstance(last_updated, (int, float)):
+                expires_at = last_updated + self._update_interval
+            else:
+                expires_at = now + self._update_interval
+        return max(expires_at, now + self._min_ttl)
+
+
+rates_cache = RatesCache(fetch_exchange_rates)
+
+
+class UnknownCurrencyError(Exception):
+    pass
+
+
+# Производные таблицы: код -> (исходная таблица USD, результат)
+_cross_rates: dict[str, tuple[dict[str, Any], dict[str, Any]]] = {}
+
+
+async def get_rates(currency_code: str) -> dict[str, Any]:
+    if not CROSS_RATE_MODE or currency_code == CROSS_RATE_BASE:
+        return await rates_cache.get(currency_code)
+    source = await rates_cache.get(CROSS_RATE_BASE)
+    cached = _cross_rates.get(currency_code)
+    if cached is not None and cached[0] is source:
+        return cached[1]
+    data = derive_cross_rates(source, currency_code)
+    _cross_rates[currency_code] = (source, data)
+    return data
+
+
+def derive_cross_rates(source: dict[str, Any], currency_code: str) -> dict[str, Any]:
+    rates = source["rates"]
+    divisor = rates.get(currency_code)
+    if not divisor:
+        raise UnknownCurrencyError(currency_code)
+    derived = {
+        code: float(f"{rate / divisor:.{CROSS_RATE_PRECISION}g}")
+        for code, rate in rates.items()
+    }
+    derived[currency_code] = 1
+    return {
+        "base": currency_code,
+        "date": source["date"],
+        "time_last_updated": source["time_last_updated"],
+        "rates": derived,
+    }
+
+
+@dataclass
+class _RenderedResponse:
+    source: dict[str, Any]
+    body: bytes
+    etag: bytes
+    headers: list[tuple[bytes, bytes]]
+
+
+# Готовые тела ответов по коду валюты; пересобираются только при смене данных
+_rendered: dict[str, _RenderedResponse] = {}
+
+
+def render_rates(data: dict[str, Any]) -> _RenderedResponse:
+    cached = _rendered.get(data["base"])
+    if cached is not None and cached.source is data:
+        return cached
     result = {
         "provider": PROVIDER,
         "WARNING_UPGRADE_TO_V6": WARNING_UPGRADE_TO_V6,
@@ -73,29 +457,35 @@ async def app(scope: Dict, receive: Any, send: Any) -> None:
         "rates": data["rates"],
     }
     body = json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
-    await send(
-        {
-            "type": "http.response.start",
-            "status": 200,
-            "headers": [
-                (b"content-type", b"application/json; charset=utf-8"),
-                (b"content-length", str(len(body)).encode()),
-            ],
-        }
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'.encode()
+    rendered = _RenderedResponse(
+        source=data,
+        body=body,
+        etag=etag,
+        headers=[
+            (b"content-type", b"application/json; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+            (b"etag", etag),
+        ],
     )
-    await send({"type": "http.response.body", "body": body})
+    _rendered[data["base"]] = rendered
+    return rendered
 
 
-async def fetch_exchange_rates(currency_code: str) -> Dict[str, Any]:
-    url = API_URL_PATTERN.format(currency=currency_code)
-    loop = asyncio.get_event_loop()
-    data = await loop.run_in_executor(
-        None,
-        lambda: json.loads(
-            urllib.request.urlopen(url, timeout=5).read().decode("utf-8")
-        ),
-    )
-    return data
+def etag_matches(scope: dict, etag: bytes) -> bool:
+    for name, value in scope.get("headers", []):
+        if name != b"if-none-match":
+            continue
+        if value.strip() == b"*":
+            return True
+        # Для If-None-Match используется слабое сравнение (RFC 9110)
+        for candidate in value.split(b","):
+            candidate = candidate.strip()
+            if candidate.startswith(b"W/"):
+                candidate = candidate[2:]
+            if candidate == etag:
+                return True
+    return False
 
 
 # -------------------------------
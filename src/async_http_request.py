@@ -6,9 +6,17 @@
 # Обработайте возможные исключения (например, таймауты, недоступные ресурсы) и присвойте соответствующие статус-коды
 # (например, 0 для ошибок соединения).
 # Сохраните все результаты в файл
+#
+# fetch_urls_stream — вариант для миллионов URL: принимает любой (в т.ч. асинхронный) итерируемый
+# источник, держит в работе не больше window задач и пишет строку {url: status} сразу по готовности.
+# method="HEAD" проверяет только статус, не скачивая тела.
 
 import asyncio
+import contextlib
 import json
+from collections import Counter
+from collections.abc import AsyncIterable, Iterable
+from urllib.parse import urlsplit
 
 import aiohttp
 from aiohttp import ClientError
@@ -20,25 +28,83 @@ URLS = [
 ]
 
 
+class HostSemaphores:
+    """Не больше limit одновременных запросов к одному хосту.
+
+    Семафор хоста живёт, пока к нему есть активные или ждущие запросы: в потоковом
+    режиме словарь ограничен окном задач, а не числом хостов в источнике.
+
+    В отличие от HostLimiter из async_http_request_upgrade, URL не откладываются:
+    здесь запрос — отдельная задача, и ожидание слота держит только её, а не воркера
+    из фиксированного пула. Короткие запросы статуса не требуют и AIMD-регулятора.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._hosts: dict[str, list] = {}  # хост -> [семафор, число пользователей]
+
+    def __len__(self) -> int:
+        return len(self._hosts)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url: str):
+        host = urlsplit(url).netloc.lower()
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._hosts[host]
+
+
 async def fetch_url(
-    session: aiohttp.ClientSession, url: str, sem: asyncio.Semaphore
+    session: aiohttp.ClientSession,
+    url: str,
+    sem: asyncio.Semaphore,
+    host_sem: contextlib.AbstractAsyncContextManager | None = None,
+    method: str = "GET",
 ) -> tuple[str, int]:
     """Выполнение одного запроса с обработкой ошибок."""
-    async with sem:  # ограничиваем число одновременных запросов
-        try:
-            async with session.get(url, timeout=10) as response:
-                return url, response.status
-        except (asyncio.TimeoutError, ClientError, Exception):
-            # Возвращаем 0 для любых ошибок сети
-            return url, 0
+    # Сначала слот хоста, потом общий: ждущие медленный хост не занимают общие слоты
+    async with host_sem or contextlib.nullcontext():
+        async with sem:  # ограничиваем число одновременных запросов
+            try:
+                async with session.request(
+                    method, url, timeout=10, allow_redirects=True
+                ) as response:
+                    if method == "HEAD" and response.status in (405, 501):
+                        # Сервер не поддерживает HEAD — спрашиваем статус через GET
+                        async with session.get(url, timeout=10) as fallback:
+                            return url, fallback.status
+                    return url, response.status
+            except (asyncio.TimeoutError, ClientError, Exception):
+                # Возвращаем 0 для любых ошибок сети
+                return url, 0
 
 
-async def fetch_urls(urls: list[str], file_path: str):
+async def fetch_urls(
+    urls: list[str], file_path: str, per_host_limit: int | None = None
+):
     results = {}
     sem = asyncio.Semaphore(5)  # максимум 5 параллельных запросов
+    # Не больше per_host_limit одновременных запросов к одному хосту
+    hosts = HostSemaphores(per_host_limit) if per_host_limit else None
 
     async with aiohttp.ClientSession() as session:
-        tasks = [fetch_url(session, url, sem) for url in urls]
+        tasks = [
+            fetch_url(
+                session,
+                url,
+                sem,
+                hosts.slot(url) if hosts is not None else None,
+            )
+            for url in urls
+        ]
         for cor in asyncio.as_completed(
             tasks
         ):  # собираем результаты по мере готовности
@@ -53,5 +119,61 @@ async def fetch_urls(urls: list[str], file_path: str):
     return results
 
 
+async def _iterate(urls: Iterable[str] | AsyncIterable[str]):
+    if isinstance(urls, AsyncIterable):
+        async for url in urls:
+            yield url
+    else:
+        for url in urls:
+            yield url
+
+
+async def fetch_urls_stream(
+    urls: Iterable[str] | AsyncIterable[str],
+    file_path: str,
+    limit: int = 5,
+    window: int | None = None,
+    method: str = "GET",
+    per_host_limit: int | None = None,
+) -> Counter:
+    """Потоковый вариант fetch_urls: память не растёт с числом URL, возвращает сводку по статусам."""
+    sem = asyncio.Semaphore(limit)
+    hosts = HostSemaphores(per_host_limit) if per_host_limit else None
+    window = window or limit * 2
+    summary = Counter()
+    pending = set()
+
+    with open(file_path, "w", encoding="utf-8") as f:
+
+        def write_done(done):
+            for task in done:
+                url, status = task.result()
+                summary[status] += 1
+                json.dump({url: status}, f, ensure_ascii=False)
+                f.write("\n")
+            f.flush()
+
+        async with aiohttp.ClientSession() as session:
+            async for url in _iterate(urls):
+                if len(pending) >= window:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    write_done(done)
+                host_sem = hosts.slot(url) if hosts is not None else None
+                pending.add(
+                    asyncio.create_task(
+                        fetch_url(session, url, sem, host_sem, method=method)
+                    )
+                )
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                write_done(done)
+
+    return summary
+
+
 if __name__ == "__main__":
     asyncio.run(fetch_urls(URLS, "./results.jsonl"))
@@ -11,15 +11,90 @@
 # Урлов в файле может быть десятки тысяч
 # Некоторые урлы могут весить до 300-500 мегабайт
 # При внезапной остановке и/или перезапуске скрипта - допустимо скачивание урлов по новой.
+#
+# Режим resume: завершённые URL записываются в журнал (дописываемый файл 16-байтовых хешей),
+# при перезапуске они пропускаются, а выходной файл дописывается, а не перезаписывается.
+# С range_resume=True большие тела качаются во временный .part-файл и докачиваются через Range.
+#
+# parse_mode управляет разбором тела:
+#   "buffered"    — тело читается целиком и разбирается json.loads (по умолчанию);
+#   "stream"      — JSON разбирается по мере прихода чанков, без сырого тела и строки в памяти;
+#   "passthrough" — сырые байты тела сразу пишутся в выходную запись и проверяются
+#                   по ходу без построения объектов, память воркера не зависит от размера тела.
+#
+# Результаты пишет одна задача-писатель (ResultWriter): воркеры отдают строки через
+# ограниченную очередь, файл открыт один раз, запись идёт пачками по размеру/времени.
+# Опционально: fsync после каждой пачки и сжатый вывод (gzip или zstd).
+#
+# per_host_limit ограничивает число одновременных запросов к одному хосту: URL занятого хоста
+# откладываются, и воркер берёт следующий, так что медленный хост не держит всех воркеров.
+# adaptive=True включает AIMD-регулятор общей конкурентности (от concurrency до
+# max_concurrency) по задержке до заголовков и доле ошибок.
+# Счётчики (URL/s, байт/s, in-flight, гистограммы задержек по хостам, классы ошибок)
+# собираются в CrawlStats и печатаются/сохраняются каждые stats_interval секунд.
+#
+# decoder="process" переносит json.loads (и необязательный transform) в пул процессов,
+# чтобы разбор не упирался в GIL; крупные тела передаются через shared memory или
+# через уже скачанный .part-файл, а не пиклингом байт. Сравнение — json_decode_benchmark.py.
 
 
 import asyncio
+import codecs
+import contextlib
+import gzip
+import hashlib
 import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import (
+    get_all_start_methods,
+    get_context,
+    shared_memory,
+)
+from urllib.parse import urlsplit
 
 import aiofiles
 import aiohttp
 from aiohttp import ClientResponseError, ClientTimeout
 
+try:
+    import zstandard
+except ImportError:  # zstd-сжатие вывода опционально
+    zstandard = None
+
+JOURNAL_DIGEST_SIZE = 16
+# Тела меньше этого размера докачивать нет смысла — качаем в память
+RANGE_RESUME_MIN_SIZE = 8 * 1024 * 1024
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-\d+/(?:\d+|\*)")
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Сколько сериализованных элементов копить перед записью в spool-файл
+SPOOL_BUFFER_SIZE = 1024 * 1024
+
+PARSE_MODES = ("buffered", "stream", "passthrough")
+
+WRITER_QUEUE_SIZE = 1000
+WRITER_BATCH_SIZE = 1024 * 1024
+WRITER_FLUSH_INTERVAL = 1.0
+COMPRESSIONS = (None, "gzip", "zstd")
+
+# Сколько URL занятых хостов можно отложить, прежде чем воркер начнёт ждать слот
+MAX_DEFERRED_URLS = 10_000
+# AIMD: задержка до заголовков выше цели или ошибка — сигнал перегрузки
+ADAPTIVE_TARGET_LATENCY = 2.0
+ADAPTIVE_BACKOFF = 0.5
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DECODERS = ("thread", "process")
+# Тела от этого размера уходят в процесс-декодер через shared memory
+SHARED_MEMORY_THRESHOLD = 1024 * 1024
+
 
 # Вспомогательная генерация списка URL для тестов
 def generate_test_urls(filename="urls.txt", count=10):
@@ -30,75 +105,1351 @@ def generate_test_urls(filename="urls.txt", count=10):
 
 
 # Основная оркестрация: очередь и распределение заданий
-async def fetch_urls(input_file: str, output_file: str, concurrency: int = 5):
-    queue = asyncio.Queue(maxsize=concurrency * 2)
+async def fetch_urls(
+    input_file: str,
+    output_file: str,
+    concurrency: int = 5,
+    resume: bool = False,
+    journal_file: str | None = None,
+    range_resume: bool = False,
+    partial_dir: str | None = None,
+    parse_mode: str = "buffered",
+    compression: str | None = None,
+    fsync: bool = False,
+    per_host_limit: int | None = None,
+    adaptive: bool = False,
+    max_concurrency: int | None = None,
+    stats_interval: float | None = None,
+    stats_file: str | None = None,
+    decoder: str = "thread",
+    decode_workers: int | None = None,
+    transform=None,
+):
+    if parse_mode not in PARSE_MODES:
+        raise ValueError(f"parse_mode must be one of {PARSE_MODES}")
+    if decoder not in DECODERS:
+        raise ValueError(f"decoder must be one of {DECODERS}")
+    if (decoder != "thread" or transform is not None) and parse_mode != "buffered":
+        raise ValueError("decoder and transform require parse_mode='buffered'")
 
-    # Очистить выходной файл заранее
-    async with aiofiles.open(output_file, "w", encoding="utf-8") as f:
-        await f.write("")
+    stats = CrawlStats()
+    limiter = None
+    workers = concurrency
+    if adaptive:
+        workers = max_concurrency or concurrency * 8
+        limiter = AdaptiveLimiter(concurrency, max_limit=workers)
+    hosts = HostLimiter(per_host_limit) if per_host_limit else None
+    queue = asyncio.Queue(maxsize=workers * 2)
+
+    if resume and journal_file is None:
+        journal_file = output_file + ".journal"
+    if range_resume and partial_dir is None:
+        partial_dir = output_file + ".parts"
+    if partial_dir is not None:
+        os.makedirs(partial_dir, exist_ok=True)
+
+    if not resume and journal_file is not None and os.path.exists(journal_file):
+        # Начинаем с нуля: старый журнал не должен пропускать URL
+        os.remove(journal_file)
+
+    journal = None
+    if journal_file is not None:
+        journal = Journal(journal_file)
+        await journal.open()
+
+    # Выходной файл очищается заранее, если это не продолжение
+    writer = ResultWriter(
+        output_file,
+        append=resume,
+        compression=compression,
+        fsync=fsync,
+        journal=journal,
+    )
+    await writer.start()
+
+    body_decoder = None
+    if decoder != "thread" or transform is not None:
+        body_decoder = BodyDecoder(decoder, decode_workers, transform)
+        body_decoder.start()
+
+    reporter = None
+    if stats_interval:
+        reporter = asyncio.create_task(
+            report_stats(stats, stats_interval, stats_file, limiter)
+        )
 
     timeout = ClientTimeout(total=None, sock_connect=30, sock_read=600)
-    async with aiohttp.ClientSession(timeout=timeout, trust_env=True) as session:
-        tasks = [
-            asyncio.create_task(worker(f"worker-{i + 1}", queue, session, output_file))
-            for i in range(concurrency)
-        ]
-        async for url in read_urls(input_file):
-            await queue.put(url)
-        for _ in range(concurrency):
-            await queue.put(None)
-        await asyncio.gather(*tasks)
+    # Коннектор не должен упираться в свой лимит раньше нашего регулятора
+    connector = aiohttp.TCPConnector(limit=max(workers, 100))
+    failure = None
+    try:
+        async with aiohttp.ClientSession(
+            timeout=timeout,
+            trust_env=True,
+            connector=connector,
+            trace_configs=[make_trace_config(stats, limiter)],
+        ) as session:
+            tasks = [
+                asyncio.create_task(
+                    worker(
+                        f"worker-{i + 1}",
+                        queue,
+                        session,
+                        writer,
+                        partial_dir=partial_dir,
+                        parse_mode=parse_mode,
+                        hosts=hosts,
+                        limiter=limiter,
+                        stats=stats,
+                        decoder=body_decoder,
+                    )
+                )
+                for i in range(workers)
+            ]
+            await run_until_failure(
+                produce_urls(queue, input_file, journal, workers), tasks
+            )
+    except BaseException as e:
+        failure = e
+        raise
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        try:
+            await writer.close()
+        except Exception as e:
+            if failure is None:
+                raise
+            # Обход уже падает со своей ошибкой — она и уходит наверх,
+            # а сбой писателя прикладываем к ней, а не подменяем её
+            if e is not failure:
+                failure.add_note(f"ResultWriter also failed: {e!r}")
+        finally:
+            if journal is not None:
+                await journal.close()
+            if body_decoder is not None:
+                body_decoder.close()
+    snapshot = stats.snapshot(limiter)
+    if stats_file is not None:
+        write_stats_file(stats_file, snapshot)
+    return snapshot
+
+
+async def produce_urls(queue, input_file: str, journal, workers: int):
+    async for url in read_urls(input_file, skip=journal):
+        await queue.put(url)
+    for _ in range(workers):
+        await queue.put(None)
+
+
+# Продюсер и воркеры ждутся вместе: если воркер упал (например, писатель не может
+# писать), продюсер не должен вечно ждать места в очереди — остальные задачи
+# отменяются, а ошибка поднимается
+async def run_until_failure(producer, tasks):
+    pending = {asyncio.create_task(producer), *tasks}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_EXCEPTION
+            )
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
 
 
 # Асинхронный генератор для чтения URL из файла
-async def read_urls(file_path: str):
+async def read_urls(file_path: str, skip=None):
     async with aiofiles.open(file_path, "r", encoding="utf-8") as f:
         async for line in f:
             url = line.strip()
-            if url:
+            if url and (skip is None or url not in skip):
                 yield url
 
 
-# Асинхронная запись результата
-async def write_result(output_file: str, url: str, data):
-    line = json.dumps({url: data}, ensure_ascii=False)
-    async with aiofiles.open(output_file, "a", encoding="utf-8") as f:
-        await f.write(line + "\n")
+def url_digest(url: str) -> bytes:
+    return hashlib.blake2b(
+        url.encode("utf-8"), digest_size=JOURNAL_DIGEST_SIZE
+    ).digest()
+
+
+# Журнал завершённых URL: дописываемый файл из хешей фиксированной длины
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self._done: set[bytes] = set()
+        self._file = None
+
+    async def open(self):
+        if os.path.exists(self.path):
+            async with aiofiles.open(self.path, "rb") as f:
+                raw = await f.read()
+            # Недописанная при падении последняя запись отбрасывается
+            complete = len(raw) - len(raw) % JOURNAL_DIGEST_SIZE
+            if complete != len(raw):
+                os.truncate(self.path, complete)
+            self._done = {
+                raw[i : i + JOURNAL_DIGEST_SIZE]
+                for i in range(0, complete, JOURNAL_DIGEST_SIZE)
+            }
+        self._file = await aiofiles.open(self.path, "ab")
+
+    def __contains__(self, url: str) -> bool:
+        return url_digest(url) in self._done
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    async def add(self, url: str):
+        await self.add_many([url])
+
+    async def add_many(self, urls):
+        digests = []
+        for url in urls:
+            digest = url_digest(url)
+            if digest not in self._done:
+                self._done.add(digest)
+                digests.append(digest)
+        if digests:
+            await self._file.write(b"".join(digests))
+            await self._file.flush()
+
+    async def close(self):
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+
+
+# Недописанная при падении последняя строка отбрасывается, как и в Journal.open:
+# иначе следующая запись приклеится к ней и испортит обе. Её URL ещё не в журнале
+# (он пишется после строки), так что он будет скачан заново
+def truncate_torn_line(path: str):
+    try:
+        f = open(path, "rb+")
+    except FileNotFoundError:
+        return
+    with f:
+        end = pos = f.seek(0, os.SEEK_END)
+        cut = 0
+        while pos > 0:
+            start = max(0, pos - DOWNLOAD_CHUNK_SIZE)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline >= 0:
+                cut = start + newline + 1
+                break
+            pos = start
+        if cut != end:
+            f.truncate(cut)
+
+
+# Готовая выходная запись, собранная на диске в режиме passthrough
+class SpooledRecord:
+    def __init__(self, path: str):
+        self.path = path
+
+
+# Единственный писатель результатов: одна открытая запись, пачки по размеру/времени
+class ResultWriter:
+    def __init__(
+        self,
+        path: str,
+        append: bool = False,
+        compression: str | None = None,
+        fsync: bool = False,
+        journal: Journal | None = None,
+        batch_size: int = WRITER_BATCH_SIZE,
+        flush_interval: float = WRITER_FLUSH_INTERVAL,
+        queue_size: int = WRITER_QUEUE_SIZE,
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {COMPRESSIONS}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression requires the zstandard package")
+        self.path = path
+        self.spool_dir = os.path.dirname(os.path.abspath(path))
+        self._append = append
+        self._compression = compression
+        self._fsync = fsync
+        self._journal = journal
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._raw = None
+        self._file = None
+        self._task = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._open)
+        self._task = asyncio.create_task(self._run())
+
+    async def write(self, url: str, data):
+        if isinstance(data, SpooledRecord):
+            await self._put((url, data))
+            return
+        line = json.dumps({url: data}, ensure_ascii=False) + "\n"
+        await self._put((url, line.encode("utf-8")))
+
+    async def _put(self, item):
+        # Если задача-писатель упала (ENOSPC, ошибка журнала), очередь никто не разбирает:
+        # вместо вечного ожидания места поднимаем её ошибку
+        if self._task is None or self._task.done():
+            self._raise_stopped()
+        if not self._queue.full():
+            self._queue.put_nowait(item)
+            return
+        put = asyncio.ensure_future(self._queue.put(item))
+        try:
+            await asyncio.wait({put, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not put.done():
+                put.cancel()
+        if self._task.done():
+            self._raise_stopped()
+
+    def _raise_stopped(self):
+        if self._task is not None and not self._task.cancelled():
+            error = self._task.exception()
+            if error is not None:
+                raise error
+        raise RuntimeError("ResultWriter is closed")
+
+    async def close(self):
+        if self._task is None:
+            return
+        try:
+            # Упавшей задаче маркер конца не нужен: put в полную очередь не завершится
+            if not self._task.done():
+                await self._put(None)
+            await self._task
+        finally:
+            self._task = None
+            self._discard_pending()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._close)
+
+    def _discard_pending(self):
+        # После сбоя в очереди могут остаться spool-файлы, которые уже никто не скопирует
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None and isinstance(item[1], SpooledRecord):
+                with contextlib.suppress(OSError):
+                    os.remove(item[1].path)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch: list[bytes] = []
+        urls: list[str] = []
+        size = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else deadline - loop.time()
+            try:
+                if timeout is not None and timeout <= 0:
+                    raise asyncio.TimeoutError
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = False  # истёк интервал — сбрасываем накопленное
+            if item is None or item is False or isinstance(item[1], SpooledRecord):
+                if batch:
+                    await self._flush(batch, urls)
+                    batch, urls, size, deadline = [], [], 0, None
+                if item is None:
+                    return
+                if item is False:
+                    continue
+                url, record = item
+                try:
+                    await loop.run_in_executor(None, self._copy_spooled, record)
+                finally:
+                    os.remove(record.path)
+                if self._journal is not None:
+                    await self._journal.add(url)
+                continue
+            url, line = item
+            batch.append(line)
+            urls.append(url)
+            size += len(line)
+            if deadline is None:
+                deadline = loop.time() + self._flush_interval
+            if size >= self._batch_size:
+                await self._flush(batch, urls)
+                batch, urls, size, deadline = [], [], 0, None
+
+    async def _flush(self, batch: list[bytes], urls: list[str]):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_batch, b"".join(batch))
+        # URL попадает в журнал только после того, как его строка записана
+        if self._journal is not None:
+            await self._journal.add_many(urls)
+
+    def _open(self):
+        if self._append and self._compression is None:
+            truncate_torn_line(self.path)
+        # Сжатый вывод так не починить: оборванный при падении gzip-член или
+        # zstd-кадр остаётся в файле, и распаковка всего файла на нём споткнётся.
+        # Для resume с gzip/zstd надёжнее писать в новый файл
+        self._raw = open(self.path, "ab" if self._append else "wb")
+        if self._compression == "gzip":
+            # При дозаписи получается многочленный gzip — это валидный формат
+            self._file = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        elif self._compression == "zstd":
+            self._file = zstandard.ZstdCompressor().stream_writer(
+                self._raw, closefd=False
+            )
+        else:
+            self._file = self._raw
+
+    def _write_batch(self, data: bytes):
+        self._file.write(data)
+        self._sync()
+
+    def _copy_spooled(self, record: SpooledRecord):
+        with open(record.path, "rb") as src:
+            shutil.copyfileobj(src, self._file, DOWNLOAD_CHUNK_SIZE)
+        self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        if self._file is not self._raw:
+            self._raw.flush()
+        if self._fsync:
+            os.fsync(self._raw.fileno())
+
+    def _close(self):
+        if self._file is not None and self._file is not self._raw:
+            self._file.close()
+        if self._raw is not None:
+            self._raw.close()
+        self._file = self._raw = None
 
 
 # Асинхронный парсинг JSON через executor для избежания блокировки event loop
-async def parse_json_bytes(body_bytes: bytes):
+async def parse_json_bytes(body_bytes: bytes, decoder=None):
+    if decoder is not None:
+        return await decoder.decode(body_bytes)
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, json.loads, body_bytes.decode("utf-8"))
 
 
+class RemoteJSONDecodeError(json.JSONDecodeError):
+    """Ошибка разбора из процесса-декодера — без исходного документа в пикле."""
+
+    def __init__(self, msg: str, pos: int, lineno: int, colno: int):
+        ValueError.__init__(self, f"{msg}: line {lineno} column {colno} (char {pos})")
+        self.msg = msg
+        self.doc = ""
+        self.pos = pos
+        self.lineno = lineno
+        self.colno = colno
+
+    def __reduce__(self):
+        return self.__class__, (self.msg, self.pos, self.lineno, self.colno)
+
+
+class TransformError(Exception):
+    """Исключение из transform пользователя — ошибка этого URL, а не всего обхода."""
+
+
+def _decode_bytes(body, transform=None):
+    try:
+        data = json.loads(bytes(body).decode("utf-8"))
+    except json.JSONDecodeError as e:
+        raise RemoteJSONDecodeError(e.msg, e.pos, e.lineno, e.colno) from None
+    if transform is None:
+        return data
+    try:
+        return transform(data)
+    except Exception as e:
+        # Заворачиваем, чтобы отличить от локальных сбоев (OSError диска и т.п.)
+        raise TransformError(f"{type(e).__name__}: {e}") from e
+
+
+def _decode_shared(name: str, size: int, transform=None):
+    # Сегментом владеет родитель: он же удаляет его после ответа
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return _decode_bytes(shm.buf[:size], transform)
+    finally:
+        shm.close()
+
+
+def _decode_file(path: str, transform=None):
+    with open(path, "rb") as f:
+        return _decode_bytes(f.read(), transform)
+
+
+# Разбор тел в пуле потоков (по умолчанию) или процессов. transform выполняется там же,
+# поэтому фильтрация большого ответа не гоняет его целиком обратно в основной процесс.
+# В режиме process transform должен быть функцией уровня модуля (пиклится)
+class BodyDecoder:
+    def __init__(
+        self,
+        mode: str = "thread",
+        workers: int | None = None,
+        transform=None,
+        shared_memory_threshold: int = SHARED_MEMORY_THRESHOLD,
+    ):
+        if mode not in DECODERS:
+            raise ValueError(f"decoder must be one of {DECODERS}")
+        self.mode = mode
+        self.workers = workers
+        self.transform = transform
+        self.shared_memory_threshold = shared_memory_threshold
+        self._executor = None
+
+    def start(self):
+        if self.mode == "process" and self._executor is None:
+            # fork из процесса с потоками (aiofiles, executor) небезопасен
+            method = (
+                "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+            )
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=get_context(method)
+            )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def _run(self, func, *args):
+        executor = self._executor
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # Процесс-декодер упал (transform, нехватка памяти): этот URL — ошибка,
+            # следующие тела идут в новый пул, а не падают вслед за ним
+            if self._executor is executor:
+                executor.shutdown(wait=False)
+                self._executor = None
+                self.start()
+            raise
+
+    async def decode(self, body: bytes):
+        if self._executor is None or len(body) < self.shared_memory_threshold:
+            return await self._run(_decode_bytes, body, self.transform)
+        shm = shared_memory.SharedMemory(create=True, size=len(body))
+        try:
+            shm.buf[: len(body)] = body
+            return await self._run(_decode_shared, shm.name, len(body), self.transform)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    # Тело уже на диске (.part-файл): процессу передаётся только путь
+    async def decode_file(self, path: str):
+        if self._executor is None:
+            async with aiofiles.open(path, "rb") as f:
+                body = await f.read()
+            return await self.decode(body)
+        return await self._run(_decode_file, path, self.transform)
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Хвост, которым число может продолжиться в следующем чанке: "1" -> "1.5", "1e" -> "1e-3"
+_NUMBER_TAIL = re.compile(r"(?:\.|[eE][-+]?)?")
+# Оборванный на границе чанка скаляр ("tru", "-") короче этого; длиннее — ошибка в данных
+PARTIAL_TOKEN_LIMIT = 64
+
+
+class JSONItemParser:
+    """
+    Потоковый разбор JSON по чанкам байт.
+
+    Контейнер, целиком лежащий в буфере, разбирается одним raw_decode; в недочитанный
+    контейнер парсер спускается и отдаёт его элементы по одному, на любой глубине:
+    ("array", key) / ("object", key) — начало контейнера (key — имя поля в
+    объекте-родителе, иначе None), ("item", value) / ("member", (key, value)) —
+    готовый элемент, ("end", None) — конец контейнера, ("value", value) — значение
+    верхнего уровня, пришедшее целиком.
+
+    Сырой текст держится только для недоразобранного хвоста: для {"data": [...]}
+    память — чанк плюс самый крупный скаляр (строка), а не всё тело. Ограничение:
+    недочитанный контейнер пробуется raw_decode один раз, поэтому глубоко вложенный
+    недочитанный документ просматривается по разу на уровень вложенности.
+    """
+
+    def __init__(self):
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._pending: list[str] = []
+        self._pending_len = 0
+        # Сколько неразобранных символов нужно накопить до следующей попытки:
+        # удвоение не даёт длинной строке разбираться заново на каждом чанке
+        self._need = 0
+        self._state = "value"
+        self._stack: list[str] = []  # закрывающие скобки открытых контейнеров
+        self._key = None
+        self._final = False
+
+    def feed(self, chunk: bytes) -> list:
+        text = self._text.decode(chunk)
+        if text:
+            self._pending.append(text)
+            self._pending_len += len(text)
+        if len(self._buf) - self._pos + self._pending_len < self._need:
+            return []
+        return self._parse()
+
+    def close(self) -> list:
+        text = self._text.decode(b"", final=True)
+        if text:
+            self._pending.append(text)
+            self._pending_len += len(text)
+        self._final = True
+        events = self._parse()
+        if self._state != "done":
+            raise json.JSONDecodeError("Unexpected end of data", self._buf, self._pos)
+        return events
+
+    def _emit(self, events: list, value):
+        stack = self._stack
+        if not stack:
+            events.append(("value", value))
+        elif stack[-1] == "}":
+            events.append(("member", (self._key, value)))
+        else:
+            events.append(("item", value))
+        self._state = "after" if stack else "done"
+
+    def _incomplete(self, buf: str, pos: int, error: json.JSONDecodeError) -> bool:
+        # Скаляр оборван концом буфера, а не ошибочен
+        if buf[pos] == '"':
+            return error.msg.startswith("Unterminated string") or error.pos + 6 > len(
+                buf
+            )
+        return len(buf) - pos < PARTIAL_TOKEN_LIMIT
+
+    def _parse(self) -> list:
+        buf = self._buf = self._buf[self._pos :] + "".join(self._pending)
+        self._pos = 0
+        self._pending.clear()
+        self._pending_len = 0
+        self._need = 0
+        stack = self._stack
+        events = []
+        while True:
+            pos = self._pos = _WHITESPACE.match(buf, self._pos).end()
+            if pos == len(buf):
+                break
+            state = self._state
+            char = buf[pos]
+            if state == "done":
+                raise json.JSONDecodeError("Extra data", buf, pos)
+            if state == "first":
+                # Сразу после открывающей скобки: пустой контейнер или первый элемент
+                if char == stack[-1]:
+                    stack.pop()
+                    events.append(("end", None))
+                    self._pos += 1
+                    self._state = "after" if stack else "done"
+                else:
+                    self._state = "key" if stack[-1] == "}" else "value"
+                continue
+            if state == "after":
+                if char == ",":
+                    self._state = "key" if stack[-1] == "}" else "value"
+                elif char == stack[-1]:
+                    stack.pop()
+                    events.append(("end", None))
+                    self._state = "after" if stack else "done"
+                else:
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+                self._pos += 1
+                continue
+            if state == "colon":
+                if char != ":":
+                    raise json.JSONDecodeError("Expecting ':' delimiter", buf, pos)
+                self._pos += 1
+                self._state = "value"
+                continue
+
+            try:
+                value, end = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if state == "value" and (char == "[" or char == "{"):
+                    # Контейнер не дочитан (или ошибочен): спускаемся в него,
+                    # ошибка, если она есть, найдётся в элементах
+                    events.append(
+                        (
+                            "array" if char == "[" else "object",
+                            self._key if stack and stack[-1] == "}" else None,
+                        )
+                    )
+                    stack.append("]" if char == "[" else "}")
+                    self._pos += 1
+                    self._state = "first"
+                    continue
+                if self._final or not self._incomplete(buf, pos, e):
+                    raise
+                self._need = 2 * (len(buf) - pos)
+                break
+            if (
+                not self._final
+                and type(value) in (int, float)
+                and _NUMBER_TAIL.fullmatch(buf, end)
+            ):
+                # Число могло оборваться на границе чанка — ждём продолжения
+                self._need = len(buf) - pos + 1
+                break
+            self._pos = end
+            if state == "key":
+                if not isinstance(value, str):
+                    raise json.JSONDecodeError(
+                        "Expecting property name enclosed in double quotes", buf, pos
+                    )
+                self._key = value
+                self._state = "colon"
+            else:
+                self._emit(events, value)
+        return events
+
+
+# Скаляры JSON на уровне байт — для проверки без построения объектов
+_JSON_WS = rb"[ \t\n\r]*"
+_JSON_STRING = rb'"(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*"'
+_JSON_SCALAR = (
+    rb"(?:"
+    + _JSON_STRING
+    + rb"|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?|true|false|null)"
+)
+_JSON_WS_BYTES = re.compile(_JSON_WS)
+_JSON_STRING_BODY = re.compile(
+    rb'(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*'
+)
+_JSON_NUMBER = re.compile(rb"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?")
+_JSON_NUMBER_TAIL = re.compile(rb"(?:\.|[eE][-+]?)?")
+
+
+def _json_value_pattern(inner: bytes) -> bytes:
+    # Скаляр или контейнер со значениями inner — на один уровень вложенности глубже
+    member = _JSON_WS + _JSON_STRING + _JSON_WS + rb":" + _JSON_WS + inner + _JSON_WS
+    item = _JSON_WS + inner + _JSON_WS
+    return (
+        rb"(?:"
+        + _JSON_SCALAR
+        + rb"|\[(?:"
+        + item
+        + rb"(?:,"
+        + item
+        + rb")*|"
+        + _JSON_WS
+        + rb")\]|\{(?:"
+        + member
+        + rb"(?:,"
+        + member
+        + rb")*|"
+        + _JSON_WS
+        + rb")\})"
+    )
+
+
+# Серии "значение," в массиве и '"ключ": значение,' в объекте (значения — до двух
+# уровней вложенности, как у типичных записей) проверяются одним match, без шага
+# цикла Python на токен; всё остальное разбирается по токенам
+_JSON_RUN_VALUE = _json_value_pattern(_json_value_pattern(_JSON_SCALAR))
+_JSON_ARRAY_RUN = re.compile(rb"(?:" + _JSON_WS + _JSON_RUN_VALUE + _JSON_WS + rb",)*")
+_JSON_OBJECT_RUN = re.compile(
+    rb"(?:"
+    + _JSON_WS
+    + _JSON_STRING
+    + _JSON_WS
+    + rb":"
+    + _JSON_WS
+    + _JSON_RUN_VALUE
+    + _JSON_WS
+    + rb",)*"
+)
+_JSON_LITERALS = (b"true", b"false", b"null")
+
+
+class JSONValidator:
+    """
+    Потоковая проверка JSON по чанкам байт без построения объектов Python.
+
+    Хранит стек открытых контейнеров и недочитанный хвост скаляра; строки проходят
+    по частям, так что память не зависит ни от размера тела, ни от размера значений.
+    Ошибка — json.JSONDecodeError (позиция в байтах) или UnicodeDecodeError.
+    """
+
+    def __init__(self):
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._tail = b""
+        self._offset = 0  # позиция начала _tail в теле — для сообщений об ошибках
+        self._stack = bytearray()  # закрывающие скобки открытых контейнеров
+        self._state = "value"
+        self._in_string = False
+        self._string_is_key = False
+
+    def feed(self, chunk: bytes):
+        self._utf8.decode(chunk)
+        self._scan(self._tail + chunk if self._tail else chunk, final=False)
+
+    def close(self):
+        self._utf8.decode(b"", final=True)
+        self._scan(self._tail, final=True)
+        if self._in_string or self._state != "done":
+            raise self._error("Unexpected end of data", len(self._tail))
+
+    def _error(self, msg: str, pos: int) -> json.JSONDecodeError:
+        return json.JSONDecodeError(msg, "", self._offset + pos)
+
+    def _scan(self, buf: bytes, final: bool):
+        stack = self._stack
+        state = self._state
+        n = len(buf)
+        pos = 0
+        while True:
+            if self._in_string:
+                pos = _JSON_STRING_BODY.match(buf, pos).end()
+                if pos == n:
+                    break  # строка продолжается в следующем чанке
+                if buf[pos] == 0x22:  # "
+                    pos += 1
+                    self._in_string = False
+                    if self._string_is_key:
+                        state = "colon"
+                    else:
+                        state = "after" if stack else "done"
+                    continue
+                if buf[pos] == 0x5C and n - pos < 6 and not final:  # \ на границе
+                    break
+                raise self._error("Invalid string content", pos)
+            pos = _JSON_WS_BYTES.match(buf, pos).end()
+            if pos == n:
+                break
+            char = buf[pos]
+            if state == "done":
+                raise self._error("Extra data", pos)
+            if state == "after":
+                if char == 0x2C:  # ,
+                    pos += 1
+                    if stack[-1] == 0x5D:
+                        pos = _JSON_ARRAY_RUN.match(buf, pos).end()
+                        state = "value"
+                    else:
+                        pos = _JSON_OBJECT_RUN.match(buf, pos).end()
+                        state = "key"
+                elif char == stack[-1]:
+                    stack.pop()
+                    pos += 1
+                    state = "after" if stack else "done"
+                else:
+                    raise self._error("Expecting ',' delimiter", pos)
+            elif state == "colon":
+                if char != 0x3A:  # :
+                    raise self._error("Expecting ':' delimiter", pos)
+                pos += 1
+                state = "value"
+            elif state == "key" or state == "key_or_close":
+                if char == 0x22:
+                    pos += 1
+                    self._in_string = True
+                    self._string_is_key = True
+                elif char == 0x7D and state == "key_or_close":
+                    stack.pop()
+                    pos += 1
+                    state = "after" if stack else "done"
+                else:
+                    raise self._error(
+                        "Expecting property name enclosed in double quotes", pos
+                    )
+            elif char == 0x7B:  # {
+                stack.append(0x7D)
+                pos += 1
+                run = _JSON_OBJECT_RUN.match(buf, pos).end()
+                state = "key" if run > pos else "key_or_close"
+                pos = run
+            elif char == 0x5B:  # [
+                stack.append(0x5D)
+                pos += 1
+                run = _JSON_ARRAY_RUN.match(buf, pos).end()
+                state = "value" if run > pos else "value_or_close"
+                pos = run
+            elif char == 0x5D and state == "value_or_close":
+                stack.pop()
+                pos += 1
+                state = "after" if stack else "done"
+            elif char == 0x22:
+                pos += 1
+                self._in_string = True
+                self._string_is_key = False
+            else:
+                end = None
+                if char == 0x2D or 0x30 <= char <= 0x39:  # - или цифра
+                    number = _JSON_NUMBER.match(buf, pos)
+                    if number:
+                        end = number.end()
+                        if not final and _JSON_NUMBER_TAIL.fullmatch(buf, end):
+                            break  # число может продолжиться в следующем чанке
+                else:
+                    for literal in _JSON_LITERALS:
+                        if buf.startswith(literal, pos):
+                            end = pos + len(literal)
+                            break
+                if end is None:
+                    if not final and n - pos < PARTIAL_TOKEN_LIMIT:
+                        break  # скаляр оборван на границе чанка
+                    raise self._error("Expecting value", pos)
+                pos = end
+                state = "after" if stack else "done"
+        self._state = state
+        self._tail = buf[pos:]
+        self._offset += pos
+
+
+# События разбора по мере поступления чанков; сам разбор идёт в executor
+async def iter_json_events(chunks):
+    loop = asyncio.get_running_loop()
+    parser = JSONItemParser()
+    async for chunk in chunks:
+        for event in await loop.run_in_executor(None, parser.feed, chunk):
+            yield event
+    for event in await loop.run_in_executor(None, parser.close):
+        yield event
+
+
+async def load_json_stream(chunks):
+    result = None
+    stack = []
+    async for kind, payload in iter_json_events(chunks):
+        if kind == "array" or kind == "object":
+            container = [] if kind == "array" else {}
+            if not stack:
+                result = container
+            elif isinstance(stack[-1], list):
+                stack[-1].append(container)
+            else:
+                stack[-1][payload] = container
+            stack.append(container)
+        elif kind == "item":
+            stack[-1].append(payload)
+        elif kind == "member":
+            stack[-1][payload[0]] = payload[1]
+        elif kind == "end":
+            stack.pop()
+        else:
+            result = payload
+    return result
+
+
+# Собирает выходную строку {url: value} во временном файле: сырые байты тела идут
+# в файл как есть (без CR/LF — внутри строк JSON их быть не может), а JSONValidator
+# проверяет их по ходу, не строя объектов. Память не зависит от размера тела.
+async def spool_json_record(url: str, chunks, spool_dir: str) -> SpooledRecord:
+    loop = asyncio.get_running_loop()
+    validator = JSONValidator()
+    fd, path = tempfile.mkstemp(dir=spool_dir, suffix=".spool")
+    os.close(fd)
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            await f.write(("{" + json.dumps(url, ensure_ascii=False) + ": ").encode())
+            async for chunk in chunks:
+                await loop.run_in_executor(None, validator.feed, chunk)
+                await f.write(chunk.translate(None, b"\r\n"))
+            validator.close()
+            await f.write(b"}\n")
+    except BaseException:
+        os.remove(path)
+        raise
+    return SpooledRecord(path)
+
+
+async def parse_body(url: str, chunks, parse_mode: str, spool_dir: str, decoder=None):
+    if parse_mode == "stream":
+        return await load_json_stream(chunks)
+    if parse_mode == "passthrough":
+        return await spool_json_record(url, chunks, spool_dir)
+    body = b"".join([chunk async for chunk in chunks])
+    return await parse_json_bytes(body, decoder)
+
+
+async def read_file_chunks(path: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    async with aiofiles.open(path, "rb") as f:
+        while chunk := await f.read(chunk_size):
+            yield chunk
+
+
 # Только запрос и raise_if_status; парсинг — отдельной функцией
-async def fetch(session: aiohttp.ClientSession, url: str):
+async def fetch(
+    session: aiohttp.ClientSession,
+    url: str,
+    partial_dir: str | None = None,
+    parse_mode: str = "buffered",
+    spool_dir: str = ".",
+    decoder=None,
+):
+    if partial_dir is not None:
+        return await fetch_resumable(
+            session, url, partial_dir, parse_mode, spool_dir, decoder
+        )
     async with session.get(url) as resp:
         resp.raise_for_status()
-        body = await resp.read()
-        return await parse_json_bytes(body)
+        if parse_mode == "buffered":
+            body = await resp.read()
+            return await parse_json_bytes(body, decoder)
+        chunks = resp.content.iter_chunked(STREAM_CHUNK_SIZE)
+        return await parse_body(url, chunks, parse_mode, spool_dir)
+
+
+# Скачивание с докачкой: большое тело пишется в .part-файл, при перезапуске
+# запрашивается только недостающий хвост (Range + If-Range)
+async def fetch_resumable(
+    session: aiohttp.ClientSession,
+    url: str,
+    partial_dir: str,
+    parse_mode: str = "buffered",
+    spool_dir: str = ".",
+    decoder=None,
+):
+    part_path = os.path.join(partial_dir, url_digest(url).hex() + ".part")
+    validator_path = part_path + ".validator"
+
+    headers = {}
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset and os.path.exists(validator_path):
+        async with aiofiles.open(validator_path, "r", encoding="utf-8") as f:
+            validator = await f.read()
+        # If-Range гарантирует, что хвост относится к той же версии ресурса
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+
+    async with session.get(url, headers=headers) as resp:
+        if resp.status == 416 or (
+            resp.status == 206 and (not headers or _content_range_start(resp) != offset)
+        ):
+            if headers:
+                # Частичный файл не соответствует ресурсу или сервер прислал не тот
+                # диапазон — качаем заново; без Range повтор не рекурсирует дальше
+                _remove_partial(part_path, validator_path)
+                return await fetch_resumable(
+                    session, url, partial_dir, parse_mode, spool_dir, decoder
+                )
+            resp.raise_for_status()
+            # 206 на запрос без Range: неизвестно, какой это кусок тела
+            raise ClientResponseError(
+                resp.request_info,
+                resp.history,
+                status=resp.status,
+                message="Unexpected partial content",
+                headers=resp.headers,
+            )
+        resp.raise_for_status()
+        if resp.status == 206:
+            mode = "ab"
+        else:
+            etag = resp.headers.get("ETag")
+            if etag is None or etag.startswith("W/"):
+                # Слабый ETag для If-Range не годится
+                etag = None
+            validator = etag or resp.headers.get("Last-Modified")
+            length = resp.content_length
+            if (
+                validator is None
+                or resp.headers.get("Accept-Ranges") != "bytes"
+                or length is None
+                or length < RANGE_RESUME_MIN_SIZE
+            ):
+                _remove_partial(part_path, validator_path)
+                if parse_mode == "buffered":
+                    body = await resp.read()
+                    return await parse_json_bytes(body, decoder)
+                chunks = resp.content.iter_chunked(STREAM_CHUNK_SIZE)
+                return await parse_body(url, chunks, parse_mode, spool_dir)
+            async with aiofiles.open(validator_path, "w", encoding="utf-8") as f:
+                await f.write(validator)
+            mode = "wb"
+        async with aiofiles.open(part_path, mode) as f:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+
+    try:
+        if parse_mode == "buffered":
+            if decoder is not None:
+                return await decoder.decode_file(part_path)
+            async with aiofiles.open(part_path, "rb") as f:
+                body = await f.read()
+            return await parse_json_bytes(body)
+        return await parse_body(url, read_file_chunks(part_path), parse_mode, spool_dir)
+    finally:
+        # Тело скачано полностью — частичный файл больше не нужен
+        _remove_partial(part_path, validator_path)
+
+
+def _content_range_start(resp: aiohttp.ClientResponse) -> int | None:
+    match = _CONTENT_RANGE.fullmatch(resp.headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+def _remove_partial(*paths: str):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+# Лимит одновременных запросов на хост. URL занятого хоста не блокируют воркер,
+# а откладываются; освободивший слот воркер сразу забирает отложенный URL того же хоста
+class HostLimiter:
+    def __init__(self, per_host: int, max_deferred: int = MAX_DEFERRED_URLS):
+        self.per_host = per_host
+        self.max_deferred = max_deferred
+        self._active: dict[str, int] = {}
+        self._deferred: dict[str, deque] = {}
+        self._deferred_count = 0
+        self._freed = asyncio.Condition()
+
+    # True — слот получен, False — URL отложен до освобождения хоста
+    async def admit(self, url: str) -> bool:
+        host = host_of(url)
+        if self._active.get(host, 0) < self.per_host:
+            self._active[host] = self._active.get(host, 0) + 1
+            return True
+        if self._deferred_count < self.max_deferred:
+            self._deferred.setdefault(host, deque()).append(url)
+            self._deferred_count += 1
+            return False
+        # Отложенных слишком много — ждём слот, чтобы не копить URL в памяти
+        async with self._freed:
+            await self._freed.wait_for(
+                lambda: self._active.get(host, 0) < self.per_host
+            )
+            self._active[host] = self._active.get(host, 0) + 1
+        return True
+
+    # Возвращает следующий отложенный URL того же хоста (слот остаётся за воркером)
+    async def release(self, url: str) -> str | None:
+        host = host_of(url)
+        backlog = self._deferred.get(host)
+        if backlog:
+            self._deferred_count -= 1
+            next_url = backlog.popleft()
+            if not backlog:
+                del self._deferred[host]
+            return next_url
+        self._active[host] -= 1
+        if not self._active[host]:
+            del self._active[host]
+        async with self._freed:
+            self._freed.notify_all()
+        return None
+
+
+# AIMD-регулятор общей конкурентности: +1/limit за каждый быстрый ответ,
+# умножение на backoff при ошибке или задержке выше цели (не чаще раза за target_latency)
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        target_latency: float = ADAPTIVE_TARGET_LATENCY,
+        backoff: float = ADAPTIVE_BACKOFF,
+    ):
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def feedback(self, latency: float | None, ok: bool):
+        if ok and latency is not None and latency <= self.target_latency:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            return
+        now = time.monotonic()
+        if now - self._last_decrease >= self.target_latency:
+            self._last_decrease = now
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+
+
+class CrawlStats:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.in_flight = 0
+        self.errors: Counter = Counter()
+        # host -> счётчики по корзинам LATENCY_BUCKETS (+ переполнение)
+        self.latency: dict[str, list[int]] = {}
+
+    def observe_latency(self, host: str, latency: float):
+        buckets = self.latency.get(host)
+        if buckets is None:
+            buckets = self.latency[host] = [0] * (len(LATENCY_BUCKETS) + 1)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+
+    def error(self, kind: str):
+        self.failed += 1
+        self.errors[kind] += 1
+
+    def snapshot(self, limiter: AdaptiveLimiter | None = None) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "elapsed": round(elapsed, 3),
+            "completed": self.completed,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "urls_per_sec": round((self.completed + self.failed) / elapsed, 2),
+            "bytes_per_sec": round(self.bytes / elapsed, 2),
+            "in_flight": self.in_flight,
+            "concurrency_limit": round(limiter.limit, 2) if limiter else None,
+            "errors": dict(self.errors),
+            "latency_buckets": [*LATENCY_BUCKETS, "inf"],
+            "latency": self.latency,
+        }
+
+
+def write_stats_file(path: str, snapshot: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+# Периодический вывод живых счётчиков; скорости считаются за последний интервал
+async def report_stats(stats, interval, stats_file=None, limiter=None):
+    loop = asyncio.get_running_loop()
+    done, received = 0, 0
+    while True:
+        await asyncio.sleep(interval)
+        snapshot = stats.snapshot(limiter)
+        urls = stats.completed + stats.failed
+        print(
+            f"stats: {(urls - done) / interval:.1f} URL/s, "
+            f"{(stats.bytes - received) / interval / 1024 / 1024:.2f} MiB/s, "
+            f"in-flight {stats.in_flight}, limit {snapshot['concurrency_limit']}, "
+            f"ok {stats.completed}, failed {stats.failed} {dict(stats.errors)}"
+        )
+        done, received = urls, stats.bytes
+        if stats_file is not None:
+            await loop.run_in_executor(None, write_stats_file, stats_file, snapshot)
+
+
+# Задержка до заголовков, байты и сетевые ошибки снимаются хуками aiohttp
+def make_trace_config(stats: CrawlStats, limiter: AdaptiveLimiter | None = None):
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.monotonic()
+
+    async def on_request_end(session, ctx, params):
+        latency = time.monotonic() - ctx.start
+        stats.observe_latency(host_of(str(params.url)), latency)
+        if limiter is not None:
+            status = params.response.status
+            limiter.feedback(latency, ok=status < 500 and status != 429)
+
+    async def on_request_exception(session, ctx, params):
+        if limiter is not None:
+            limiter.feedback(None, ok=False)
+
+    async def on_response_chunk_received(session, ctx, params):
+        stats.bytes += len(params.chunk)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    return trace_config
 
 
 # Воркеры забирают задания из очереди, централизованно логируют и обрабатывают исключения
-async def worker(name, queue, session, output_file):
+async def worker(
+    name,
+    queue,
+    session,
+    writer,
+    partial_dir=None,
+    parse_mode="buffered",
+    hosts=None,
+    limiter=None,
+    stats=None,
+    decoder=None,
+):
+    url = None
     while True:
-        url = await queue.get()
         if url is None:
+            url = await queue.get()
             queue.task_done()
-            break
-        try:
-            data = await fetch(session, url)
-        except ClientResponseError as e:
-            print(f"{name}: HTTP {e.status} for {url}")
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            print(f"{name}: Network error for {url}: {e}")
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
-            print(f"{name}: JSON decode error for {url}: {e}")
-        else:
-            await write_result(output_file, url, data)
-        finally:
-            queue.task_done()
+            if url is None:
+                break
+            if hosts is not None and not await hosts.admit(url):
+                url = None
+                continue
+        await process_url(
+            name, session, writer, url, partial_dir, parse_mode, limiter, stats, decoder
+        )
+        # Отложенный URL того же хоста обрабатываем сразу, не отдавая слот
+        url = await hosts.release(url) if hosts is not None else None
+
+
+async def process_url(
+    name, session, writer, url, partial_dir, parse_mode, limiter, stats, decoder=None
+):
+    if limiter is not None:
+        await limiter.acquire()
+    if stats is not None:
+        stats.in_flight += 1
+    try:
+        data = await fetch(
+            session, url, partial_dir, parse_mode, writer.spool_dir, decoder
+        )
+    except ClientResponseError as e:
+        print(f"{name}: HTTP {e.status} for {url}")
+        if stats is not None:
+            stats.error(f"HTTP {e.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"{name}: Network error for {url}: {e}")
+        if stats is not None:
+            stats.error(type(e).__name__)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        print(f"{name}: JSON decode error for {url}: {e}")
+        if stats is not None:
+            stats.error(type(e).__name__)
+    except (ValueError, TransformError, BrokenProcessPool) as e:
+        # Исключение из transform пользователя или сбой декодера (BrokenProcessPool) —
+        # ошибка этого URL, воркер продолжает работу. Локальные OSError (ENOSPC, EACCES
+        # на spool/.part-файле) сюда не попадают: они останавливают весь обход
+        print(f"{name}: Processing error for {url}: {e!r}")
+        if stats is not None:
+            stats.error(type(e).__name__)
+    else:
+        await writer.write(url, data)
+        if stats is not None:
+            stats.completed += 1
+    finally:
+        if stats is not None:
+            stats.in_flight -= 1
+        if limiter is not None:
+            await limiter.release()
 
 
 if __name__ == "__main__":
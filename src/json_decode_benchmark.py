@@ -0,0 +1,82 @@
+# Бенчмарк разбора JSON-тел краулера (async_http_request_upgrade): пул потоков против пула процессов.
+#
+# Тела нескольких размеров разбираются параллельно через BodyDecoder,
+# для каждого варианта выводится время и пропускная способность.
+# Вариант "+transform" оставляет от результата только число элементов — так видно,
+# сколько стоит обратная передача разобранного объекта из процесса.
+#
+# Запуск: uv run python json_decode_benchmark.py
+
+
+import asyncio
+import json
+import os
+import time
+
+from async_http_request_upgrade import BodyDecoder
+
+BODY_SIZES = [64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+# Сколько байт разбирается на каждый размер (тела разбираются одновременно)
+BYTES_PER_SIZE = 256 * 1024 * 1024
+WORKERS = os.cpu_count()
+
+
+def make_body(size: int) -> bytes:
+    record = {
+        "id": 0,
+        "title": "delectus aut autem",
+        "completed": False,
+        "tags": [1, 2, 3],
+    }
+    item = json.dumps(record).encode("utf-8")
+    count = max(1, size // (len(item) + 1))
+    return b"[" + b",".join([item] * count) + b"]"
+
+
+# Уровень модуля — чтобы функцию можно было передать в процесс
+def count_items(data) -> int:
+    return len(data)
+
+
+async def run_variant(mode: str, body: bytes, count: int, transform=None) -> float:
+    decoder = BodyDecoder(mode, WORKERS, transform)
+    decoder.start()
+    try:
+        # Прогрев: запуск процессов не должен попадать в замер
+        await decoder.decode(make_body(1024))
+        start = time.perf_counter()
+        await asyncio.gather(*(decoder.decode(body) for _ in range(count)))
+        return time.perf_counter() - start
+    finally:
+        decoder.close()
+
+
+async def main():
+    variants = [
+        ("thread", None),
+        ("process", None),
+        ("thread", count_items),
+        ("process", count_items),
+    ]
+    print(
+        "{:<12} {:<20} {:>8} {:>10} {:>10}".format(
+            "Body", "Decoder", "Bodies", "Time, s", "MB/s"
+        )
+    )
+    print("-" * 64)
+    for size in BODY_SIZES:
+        body = make_body(size)
+        count = max(1, BYTES_PER_SIZE // len(body))
+        for mode, transform in variants:
+            name = mode + ("+transform" if transform else "")
+            elapsed = await run_variant(mode, body, count, transform)
+            throughput = len(body) * count / elapsed / 1024 / 1024
+            print(
+                "{:<12} {:<20} {:>8} {:>10.3f} {:>10.1f}".format(
+                    f"{len(body) // 1024} KiB", name, count, elapsed, throughput
+                )
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
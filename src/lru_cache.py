@@ -4,48 +4,691 @@
 # Декоратор должен кешировать результаты вызовов функции на основе её аргументов.
 # Если функция вызывается с теми же аргументами, что и ранее, возвращайте результат из кеша вместо повторного выполнения функции.
 # Декоратор должно быть возможно использовать двумя способами: с указанием максимального кол-ва элементов и без.
+#
+# Кеш потокобезопасен: ключи раскладываются по сегментам (шардам), у каждого свой
+# OrderedDict, свой Lock и свои счётчики, так что попадания в разные сегменты не
+# сериализуются одним глобальным замком. LRU соблюдается внутри сегмента; маленькие
+# кеши (maxsize < 2 * MIN_SHARD_SIZE) живут в одном сегменте и ведут себя как точный LRU.
+# Как и в functools, у обёртки есть cache_info() / cache_clear() / cache_parameters(),
+# плюс cache_stats() со счётчиками вытеснений и истечений.
+#
+# Дополнительно:
+# - ttl: время жизни записи в секундах (число или функция от результата). Просроченная
+#   запись удаляется при обращении, а сегмент периодически вычищается целиком при записи
+#   (и по cache_expire()).
+# - maxbytes: бюджет по оценочному размеру значений (sizeof, по умолчанию estimate_size),
+#   вытеснение идёт, пока не уложимся и в maxsize, и в maxbytes.
+# - async def: конкурентные вызовы с одним ключом ждут одну общую задачу, а не
+#   запускают корутину каждый.
+# - backend: общий для процессов/хостов кеш второго уровня (MmapBackend — хеш-таблица
+#   в разделяемом файле на одном хосте, RedisBackend — между хостами). Локальный
+#   OrderedDict остаётся L1 перед ним; значения пишутся через serializer.
 
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import threading
+import time
 import unittest.mock
-from collections import OrderedDict
-from functools import wraps
+from collections import OrderedDict, namedtuple
+from functools import partial, wraps
 
+try:
+    import fcntl
+except ImportError:  # Windows: MmapBackend недоступен
+    fcntl = None
 
-def lru_cache(*dargs, **dkwargs):
-    # дефолтный maxsize, если не указан
-    default_maxsize = 128
+try:
+    import redis
+except ImportError:  # RedisBackend недоступен, локальный кеш работает и без него
+    redis = None
+
+DEFAULT_MAXSIZE = 128
+DEFAULT_SHARDS = 16  # сегментов не больше этого
+# Записей на сегмент: меньше — LRU внутри сегмента становится слишком грубым
+MIN_SHARD_SIZE = 64
+# Как часто при записи вычищать просроченное, если ttl задан функцией
+EXPIRE_SWEEP_INTERVAL = 60.0
+MIN_SWEEP_INTERVAL = 1.0
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+CacheStats = namedtuple(
+    "CacheStats",
+    ["hits", "misses", "evictions", "expirations", "currsize", "currbytes"],
+)
+
+Serializer = namedtuple("Serializer", ["dumps", "loads"])
+PICKLE = Serializer(
+    partial(pickle.dumps, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads
+)
+JSON = Serializer(lambda value: json.dumps(value).encode(), json.loads)
+
+# Протокол фиксирован, чтобы ключ бэкенда совпадал у процессов с разными настройками
+KEY_PICKLE_PROTOCOL = 4
+
+_MISSING = object()
+_KWD_MARK = object()  # разделитель позиционных и именованных аргументов в ключе
+_FAST_TYPES = {int, str}
+
+
+def make_key(args: tuple, kwargs: dict):
+    if kwargs:
+        # Порядок именованных аргументов не важен: f(a=1, b=2) и f(b=2, a=1) — один ключ
+        return (_KWD_MARK, args, tuple(sorted(kwargs.items())))
+    # Быстрый путь для чисто позиционных вызовов: сам кортеж args, без сортировки
+    if len(args) == 1 and type(args[0]) in _FAST_TYPES:
+        return args[0]
+    return args
+
+
+def estimate_size(obj) -> int:
+    # Грубая оценка: sys.getsizeof по объекту и всему, что в нём лежит
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__"):
+            stack.append(vars(item))
+    return total
+
+
+def _split(total, parts: int, index: int):
+    # Делим лимит между сегментами, остаток — первым сегментам
+    if total is None:
+        return None
+    return total // parts + (index < total % parts)
+
+
+class _Shard:
+    __slots__ = (
+        "lock",
+        "data",
+        "maxsize",
+        "maxbytes",
+        "bytes",
+        "next_sweep",
+        "hits",
+        "misses",
+        "evictions",
+        "expirations",
+    )
+
+    def __init__(self, maxsize, maxbytes):
+        self.lock = threading.Lock()
+        # key -> (value, expires_at | None, size)
+        self.data = OrderedDict()
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.next_sweep = 0.0
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+
+class _ShardedLRU:
+    def __init__(
+        self, maxsize, shards=None, ttl=None, maxbytes=None, sizeof=estimate_size
+    ):
+        if maxsize is not None:
+            maxsize = max(maxsize, 0)
+        if maxbytes is not None:
+            maxbytes = max(maxbytes, 0)
+        if shards is None:
+            shards = (
+                DEFAULT_SHARDS
+                if maxsize is None
+                else max(1, min(DEFAULT_SHARDS, maxsize // MIN_SHARD_SIZE))
+            )
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        if ttl is None or callable(ttl):
+            self.sweep_interval = EXPIRE_SWEEP_INTERVAL
+        else:
+            self.sweep_interval = max(ttl, MIN_SWEEP_INTERVAL)
+        self.shards = [
+            _Shard(_split(maxsize, shards, i), _split(maxbytes, shards, i))
+            for i in range(shards)
+        ]
+
+    def _shard(self, key) -> _Shard:
+        shards = self.shards
+        # Один сегмент — без лишнего хеширования ключа
+        return shards[hash(key) % len(shards)] if len(shards) > 1 else shards[0]
+
+    def get(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.data.get(key)
+            if entry is None:
+                shard.misses += 1
+                return _MISSING
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                self._drop_expired(shard, key, entry)
+                shard.misses += 1
+                return _MISSING
+            shard.hits += 1
+            shard.data.move_to_end(key)
+            return entry[0]
+
+    @staticmethod
+    def _drop_expired(shard: _Shard, key, entry):
+        del shard.data[key]
+        shard.bytes -= entry[2]
+        shard.expirations += 1
+
+    def set(self, key, value):
+        shard = self._shard(key)
+        ttl = self.ttl(value) if callable(self.ttl) else self.ttl
+        if shard.maxsize == 0 or (ttl is not None and ttl <= 0):
+            return
+        size = self.sizeof(value) if shard.maxbytes is not None else 0
+        if shard.maxbytes is not None and size > shard.maxbytes:
+            return  # одно значение больше бюджета сегмента — не кешируем вовсе
+        now = time.monotonic()
+        expires = None if ttl is None else now + ttl
+        with shard.lock:
+            # Пока функция считалась, другой поток мог уже положить этот ключ
+            old = shard.data.pop(key, None)
+            if old is not None:
+                shard.bytes -= old[2]
+            shard.data[key] = (value, expires, size)
+            shard.bytes += size
+            while (shard.maxsize is not None and len(shard.data) > shard.maxsize) or (
+                shard.maxbytes is not None and shard.bytes > shard.maxbytes
+            ):
+                _, evicted = shard.data.popitem(last=False)
+                shard.bytes -= evicted[2]
+                shard.evictions += 1
+            if self.ttl is not None and now >= shard.next_sweep:
+                self._sweep(shard, now)
+
+    def _sweep(self, shard: _Shard, now: float) -> int:
+        # Вызывается под замком сегмента
+        expired = [
+            (key, entry)
+            for key, entry in shard.data.items()
+            if entry[1] is not None and entry[1] <= now
+        ]
+        for key, entry in expired:
+            self._drop_expired(shard, key, entry)
+        shard.next_sweep = now + self.sweep_interval
+        return len(expired)
+
+    def expire(self) -> int:
+        removed = 0
+        now = time.monotonic()
+        for shard in self.shards:
+            with shard.lock:
+                removed += self._sweep(shard, now)
+        return removed
+
+    def clear(self):
+        for shard in self.shards:
+            with shard.lock:
+                shard.data.clear()
+                shard.bytes = 0
+                shard.hits = shard.misses = shard.evictions = shard.expirations = 0
+
+    def stats(self) -> CacheStats:
+        hits = misses = evictions = expirations = currsize = currbytes = 0
+        for shard in self.shards:
+            with shard.lock:
+                hits += shard.hits
+                misses += shard.misses
+                evictions += shard.evictions
+                expirations += shard.expirations
+                currsize += len(shard.data)
+                currbytes += shard.bytes
+        return CacheStats(hits, misses, evictions, expirations, currsize, currbytes)
+
+    def info(self) -> CacheInfo:
+        stats = self.stats()
+        return CacheInfo(stats.hits, stats.misses, self.maxsize, stats.currsize)
+
+
+# ---------- Бэкенды второго уровня ----------
+# Бэкенд — любой объект с методами get(namespace, key) -> bytes | None,
+# set(namespace, key, value, ttl) и clear(namespace); key — 16-байтовый дайджест
+# аргументов, value — результат serializer.dumps. Атрибут blocking=True означает,
+# что для async-функций вызовы уходят в поток (asyncio.to_thread).
+
+
+def remote_key(args: tuple, kwargs: dict) -> bytes | None:
+    # Ключ должен совпадать между процессами: pickle аргументов + blake2b
+    try:
+        data = pickle.dumps(
+            (args, sorted(kwargs.items())), protocol=KEY_PICKLE_PROTOCOL
+        )
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None  # такие аргументы кешируем только в L1
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _namespace_tag(namespace: str) -> bytes:
+    return hashlib.blake2b(namespace.encode(), digest_size=8).digest()
+
+
+class MmapBackend:
+    # Хеш-таблица фиксированного размера в файле, отображённом в память (по умолчанию
+    # в /dev/shm). Открытая адресация с коротким окном проб; при переполнении окна
+    # вытесняется запись, истекающая раньше всех. Писатели берут lockf на диапазон
+    # слота (между процессами) и локальный Lock (между потоками), читатели замков не
+    # берут: слот защищён seqlock — нечётный seq или смена seq за время чтения = промах.
+    # Слот выбирается под lockf на всё окно проб ключа: окна соседних ключей
+    # пересекаются, и два процесса иначе могут занять один пустой слот. clear(namespace)
+    # оставляет надгробия (expires = -1): цепочки проб других ключей не рвутся.
+    MAGIC = b"LRUM"
+    FILE_HEADER = struct.Struct("<4sII")  # magic, slots, slot_size
+    SLOT_HEADER = struct.Struct("<I8s16sdI")  # seq, тег namespace, ключ, expires, длина
+    SEQ = struct.Struct("<I")
+    PROBES = 8
+    TOMBSTONE = -1.0
+
+    blocking = False
+
+    def __init__(self, name="lru_cache", slots=4096, slot_size=1024, path=None):
+        if fcntl is None:
+            raise RuntimeError("MmapBackend requires fcntl (POSIX)")
+        if slot_size <= self.SLOT_HEADER.size:
+            raise ValueError(f"slot_size must be > {self.SLOT_HEADER.size}")
+        if path is None:
+            directory = (
+                "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            )
+            path = os.path.join(directory, name)
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.size = self.FILE_HEADER.size + slots * slot_size
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Инициализацию файла сериализуем между процессами
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, self.size)
+                    os.pwrite(
+                        self._fd, self.FILE_HEADER.pack(self.MAGIC, slots, slot_size), 0
+                    )
+                else:
+                    header = os.pread(self._fd, self.FILE_HEADER.size, 0)
+                    if self.FILE_HEADER.unpack(header) != (
+                        self.MAGIC,
+                        slots,
+                        slot_size,
+                    ):
+                        raise ValueError(f"{path}: created with a different layout")
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            self._mm = mmap.mmap(self._fd, self.size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def _home(self, key: bytes) -> int:
+        return int.from_bytes(key[:8], "little") % self.slots
+
+    def _offsets(self, key: bytes):
+        home = self._home(key)
+        for probe in range(min(self.PROBES, self.slots)):
+            yield self.FILE_HEADER.size + (home + probe) % self.slots * self.slot_size
+
+    def _window(self, key: bytes) -> tuple[int, int]:
+        # Диапазон lockf (длина, начало) под окно проб; окно через конец таблицы
+        # берёт всю таблицу — один диапазон за раз не даёт взаимных блокировок
+        home = self._home(key)
+        probes = min(self.PROBES, self.slots)
+        if home + probes > self.slots:
+            return self.slots * self.slot_size, self.FILE_HEADER.size
+        return probes * self.slot_size, self.FILE_HEADER.size + home * self.slot_size
+
+    def get(self, namespace: str, key: bytes) -> bytes | None:
+        tag = _namespace_tag(namespace)
+        mm = self._mm
+        for offset in self._offsets(key):
+            seq, slot_tag, slot_key, expires, length = self.SLOT_HEADER.unpack_from(
+                mm, offset
+            )
+            if not length and not seq:
+                return None  # пустой слот: дальше по окну ключа быть не может
+            if slot_key != key or slot_tag != tag or expires == self.TOMBSTONE:
+                continue
+            start = offset + self.SLOT_HEADER.size
+            value = mm[start : start + length]
+            if seq % 2 or self.SEQ.unpack_from(mm, offset)[0] != seq:
+                return None  # слот переписывают прямо сейчас
+            if expires and expires <= time.time():
+                return None
+            return value
+        return None
+
+    def set(self, namespace: str, key: bytes, value: bytes, ttl: float | None):
+        if len(value) > self.slot_size - self.SLOT_HEADER.size:
+            return  # не помещается в слот — только L1
+        tag = _namespace_tag(namespace)
+        now = time.time()
+        expires = now + ttl if ttl is not None else 0.0
+        length, start = self._window(key)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                self._write(self._choose(tag, key, now), tag, key, expires, value)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _choose(self, tag: bytes, key: bytes, now: float) -> int:
+        # Только под замком окна: иначе слот между выбором и записью займёт другой
+        mm = self._mm
+        target = None
+        victim, victim_expires = None, None
+        for offset in self._offsets(key):
+            seq, slot_tag, slot_key, expires, length = self.SLOT_HEADER.unpack_from(
+                mm, offset
+            )
+            if not length and not seq:
+                return target or offset
+            if slot_key == key and slot_tag == tag and expires != self.TOMBSTONE:
+                return offset
+            if expires and expires <= now:
+                # Надгробие или просроченный слот, но ищем дальше свой ключ
+                target = target or offset
+                continue
+            # Бессрочные записи вытесняем в последнюю очередь
+            rank = expires or float("inf")
+            if victim is None or rank < victim_expires:
+                victim, victim_expires = offset, rank
+        return target or victim
+
+    def _write(self, offset: int, tag: bytes, key: bytes, expires: float, value):
+        # Нечётный seq — «идёт запись» (уже нечётный, если прошлый писатель упал)
+        mm = self._mm
+        odd = self.SEQ.unpack_from(mm, offset)[0] | 1
+        self.SEQ.pack_into(mm, offset, odd)
+        start = offset + self.SLOT_HEADER.size
+        mm[start : start + len(value)] = value
+        self.SLOT_HEADER.pack_into(mm, offset, odd, tag, key, expires, len(value))
+        self.SEQ.pack_into(mm, offset, (odd + 1) & 0xFFFFFFFF or 2)
+
+    def clear(self, namespace: str | None = None):
+        # Без namespace — вся таблица; иначе только слоты этого namespace
+        tag = None if namespace is None else _namespace_tag(namespace)
+        empty = bytes(self.slot_size)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                for index in range(self.slots):
+                    offset = self.FILE_HEADER.size + index * self.slot_size
+                    if tag is None:
+                        self._mm[offset : offset + self.slot_size] = empty
+                    elif self.SLOT_HEADER.unpack_from(self._mm, offset)[1] == tag:
+                        # Надгробие, а не пустой слот: пустой оборвал бы поиск ключей
+                        # других namespace, лежащих дальше по их окну
+                        self._write(offset, bytes(8), bytes(16), self.TOMBSTONE, b"")
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+    def unlink(self):
+        os.unlink(self.path)
 
+
+class RedisBackend:
+    # Ключи вида "<prefix>:<namespace>:<hex дайджеста>", TTL — через PX.
+    # Ошибки Redis не ломают вызов: кеш деградирует до L1 и считает сбои в errors.
+    blocking = True
+
+    def __init__(
+        self,
+        prefix="lru",
+        redis_host="localhost",
+        redis_port=6379,
+        redis_db=0,
+        client=None,
+    ):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("RedisBackend requires the redis package")
+            client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+        self._redis = client
+        self._prefix = prefix
+        self.errors = 0
+
+    def _key(self, namespace: str, key: bytes) -> str:
+        return f"{self._prefix}:{namespace}:{key.hex()}"
+
+    def get(self, namespace: str, key: bytes) -> bytes | None:
+        try:
+            return self._redis.get(self._key(namespace, key))
+        except redis.RedisError:
+            self.errors += 1
+            return None
+
+    def set(self, namespace: str, key: bytes, value: bytes, ttl: float | None):
+        px = None if ttl is None else max(int(ttl * 1000), 1)
+        try:
+            self._redis.set(self._key(namespace, key), value, px=px)
+        except redis.RedisError:
+            self.errors += 1
+
+    def clear(self, namespace: str | None = None):
+        pattern = f"{self._prefix}:{namespace or '*'}:*"
+        batch = []
+        try:
+            for key in self._redis.scan_iter(match=pattern, count=1000):
+                batch.append(key)
+                if len(batch) >= 1000:
+                    self._redis.unlink(*batch)
+                    batch.clear()
+            if batch:
+                self._redis.unlink(*batch)
+        except redis.RedisError as e:
+            # Недоступный L2 не должен ломать cache_clear(): L1 уже очищен,
+            # а записи в Redis истекут по своему TTL
+            self.errors += 1
+            logging.warning(f"Failed to clear {pattern} in Redis: {e}")
+
+
+def lru_cache(*dargs, **dkwargs):
     # вызов без параметров: @lru_cache
     if len(dargs) == 1 and callable(dargs[0]) and not dkwargs:
         func = dargs[0]
-        return _lru_cache_decorator(default_maxsize)(func)
-    # вызов с параметрами: @lru_cache(maxsize=3)
-    return _lru_cache_decorator(dkwargs.get("maxsize", default_maxsize))
+        return _lru_cache_decorator(DEFAULT_MAXSIZE)(func)
+    # вызов с параметрами: @lru_cache(maxsize=3), @lru_cache(3), @lru_cache(ttl=60)
+    maxsize = dargs[0] if dargs else dkwargs.pop("maxsize", DEFAULT_MAXSIZE)
+    return _lru_cache_decorator(maxsize, **dkwargs)
 
 
-def _lru_cache_decorator(maxsize):
+def _lru_cache_decorator(
+    maxsize,
+    shards=None,
+    ttl=None,
+    maxbytes=None,
+    sizeof=estimate_size,
+    backend=None,
+    serializer=PICKLE,
+    namespace=None,
+):
     def decorator(func):
-        cache = OrderedDict()
-        sentinel = object()
+        cache = _ShardedLRU(maxsize, shards, ttl, maxbytes, sizeof)
+        remote = None
+        if backend is not None:
+            remote = _Remote(
+                backend,
+                serializer,
+                namespace or f"{func.__module__}.{func.__qualname__}",
+                ttl,
+            )
+        if inspect.iscoroutinefunction(func):
+            wrapper = _async_wrapper(func, cache, remote)
+        else:
+            wrapper = _sync_wrapper(func, cache, remote)
+
+        wrapper.cache_info = cache.info
+        wrapper.cache_stats = cache.stats
+        wrapper.cache_expire = cache.expire
+        wrapper.cache_parameters = lambda: {
+            "maxsize": cache.maxsize,
+            "maxbytes": cache.maxbytes,
+            "ttl": cache.ttl,
+            "typed": False,
+        }
+        return wrapper
+
+    return decorator
+
+
+class _Remote:
+    # L2: бэкенд + сериализация + namespace функции
+    def __init__(self, backend, serializer: Serializer, namespace: str, ttl):
+        self.backend = backend
+        self.serializer = serializer
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key: bytes | None):
+        if key is None:
+            return _MISSING
+        payload = self.backend.get(self.namespace, key)
+        if payload is None:
+            return _MISSING
+        return self.serializer.loads(payload)
+
+    def set(self, key: bytes | None, value):
+        ttl = self.ttl(value) if callable(self.ttl) else self.ttl
+        if key is None or (ttl is not None and ttl <= 0):
+            return
+        try:
+            payload = self.serializer.dumps(value)
+        except (pickle.PicklingError, TypeError, ValueError, AttributeError):
+            return  # несериализуемый результат остаётся только в L1
+        self.backend.set(self.namespace, key, payload, ttl)
+
+    def clear(self):
+        self.backend.clear(self.namespace)
 
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            key = (args, tuple(sorted(kwargs.items())))
-            value = cache.get(key, sentinel)
-            if value is not sentinel:
-                cache.move_to_end(key)
-                return value
 
+def _sync_wrapper(func, cache: _ShardedLRU, remote: _Remote | None = None):
+    segments = cache.shards
+    count = len(segments)
+    monotonic = time.monotonic
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if kwargs:
+            key = (_KWD_MARK, args, tuple(sorted(kwargs.items())))
+        elif len(args) == 1 and type(args[0]) in _FAST_TYPES:
+            key = args[0]
+        else:
+            key = args
+        # Горячий путь попадания развёрнут здесь же (см. make_key / _ShardedLRU.get)
+        shard = segments[hash(key) % count] if count > 1 else segments[0]
+        with shard.lock:
+            entry = shard.data.get(key)
+            if entry is not None:
+                if entry[1] is None or entry[1] > monotonic():
+                    shard.hits += 1
+                    shard.data.move_to_end(key)
+                    return entry[0]
+                cache._drop_expired(shard, key, entry)
+            shard.misses += 1
+
+        if remote is None:
             result = func(*args, **kwargs)
-            cache[key] = result
-            cache.move_to_end(key)
+        else:
+            rkey = remote_key(args, kwargs)
+            result = remote.get(rkey)
+            if result is _MISSING:
+                result = func(*args, **kwargs)
+                remote.set(rkey, result)
+        cache.set(key, result)
+        return result
 
-            if maxsize is not None and len(cache) > maxsize:
-                cache.popitem(last=False)
-            return result
+    def cache_clear():
+        cache.clear()
+        if remote is not None:
+            remote.clear()
 
-        return wrapper
+    wrapper.cache_clear = cache_clear
+    return wrapper
 
-    return decorator
+
+def _async_wrapper(func, cache: _ShardedLRU, remote: _Remote | None = None):
+    inflight = {}  # key -> задача, которую ждут все конкурентные вызовы
+    offload = remote is not None and getattr(remote.backend, "blocking", False)
+
+    async def load(args, kwargs):
+        # L2 проверяется внутри общей задачи: конкурентные вызовы не дублируют и его
+        if remote is None:
+            return await func(*args, **kwargs)
+        rkey = remote_key(args, kwargs)
+        if offload:
+            result = await asyncio.to_thread(remote.get, rkey)
+        else:
+            result = remote.get(rkey)
+        if result is _MISSING:
+            result = await func(*args, **kwargs)
+            if offload:
+                await asyncio.to_thread(remote.set, rkey, result)
+            else:
+                remote.set(rkey, result)
+        return result
+
+    def finish(key, task: asyncio.Task):
+        if inflight.get(key) is not task:
+            return  # после cache_clear() результат уже не нужен
+        del inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            cache.set(key, task.result())
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        key = make_key(args, kwargs)
+        value = cache.get(key)
+        if value is not _MISSING:
+            return value
+
+        task = inflight.get(key)
+        loop = asyncio.get_running_loop()
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(load(args, kwargs))
+            inflight[key] = task
+            task.add_done_callback(partial(finish, key))
+        # shield: отмена одного ожидающего не отменяет общую задачу для остальных
+        return await asyncio.shield(task)
+
+    def cache_clear():
+        inflight.clear()
+        cache.clear()
+        if remote is not None:
+            remote.clear()
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
 
 
 @lru_cache
@@ -85,5 +728,136 @@ if __name__ == "__main__":
     assert decorated(5, 6) == 3
     assert decorated(1, 2) == 4
     assert mocked_func.call_count == 4
+    assert decorated.cache_info() == (3, 4, 2, 2)
+    assert decorated.cache_stats().evictions == 2
+
+    decorated.cache_clear()
+    assert decorated.cache_info() == (0, 0, 2, 0)
+
+    # Именованные аргументы: порядок не важен, с позиционными не смешиваются
+    kw_mock = unittest.mock.Mock(side_effect=lambda *a, **kw: (a, kw))
+    kw_cached = lru_cache(kw_mock)
+    kw_cached(1, b=2, c=3)
+    kw_cached(1, c=3, b=2)
+    kw_cached(1, 2, 3)
+    assert kw_mock.call_count == 2
+
+    # Потокобезопасность: счётчики сходятся, размер не превышает maxsize
+    @lru_cache(maxsize=1024)
+    def square(x: int) -> int:
+        return x * x
+
+    def hammer(offset: int):
+        for i in range(20_000):
+            assert square((i + offset) % 3000) == ((i + offset) % 3000) ** 2
+
+    threads = [threading.Thread(target=hammer, args=(n * 100,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    info = square.cache_info()
+    assert info.hits + info.misses == 8 * 20_000
+    assert info.currsize <= 1024
+    assert square.cache_parameters()["maxsize"] == 1024
+
+    # TTL: просроченная запись пересчитывается, cache_expire() чистит сегменты
+    ttl_mock = unittest.mock.Mock(side_effect=lambda x: x * 10)
+    ttl_cached = lru_cache(ttl=0.05)(ttl_mock)
+    assert ttl_cached(1) == 10 and ttl_cached(1) == 10
+    assert ttl_mock.call_count == 1
+    time.sleep(0.06)
+    assert ttl_cached(1) == 10
+    assert ttl_mock.call_count == 2
+    ttl_cached(2)
+    time.sleep(0.06)
+    assert ttl_cached.cache_expire() == 2
+    assert ttl_cached.cache_stats().expirations == 3
+
+    # TTL от результата: None — без срока, <= 0 — не кешировать
+    per_entry = lru_cache(ttl=lambda value: value)(
+        unittest.mock.Mock(side_effect=[0, None])
+    )
+    per_entry(1)
+    per_entry(1)
+    assert per_entry(1) is None and per_entry.cache_info().currsize == 1
+
+    # maxbytes: крупные значения вытесняют старые, огромные не кешируются вовсе
+    @lru_cache(maxsize=None, maxbytes=10_000, shards=1)
+    def blob(size: int) -> bytes:
+        return b"x" * size
+
+    for n in range(10):
+        blob(3_000 + n)
+    stats = blob.cache_stats()
+    assert stats.currbytes <= 10_000 and stats.currsize == 3 and stats.evictions == 7
+    blob(50_000)
+    assert blob.cache_stats().currsize == 3
+
+    # async: конкурентные вызовы с одним ключом ждут одну задачу
+    calls = []
+
+    @lru_cache(maxsize=16)
+    async def fetch(x: int) -> int:
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    @lru_cache
+    async def failing(x: int) -> int:
+        calls.append(-x)
+        raise ValueError(x)
+
+    async def check_async():
+        assert await asyncio.gather(*(fetch(3) for _ in range(10))) == [6] * 10
+        assert await fetch(3) == 6
+        assert calls == [3]
+        results = await asyncio.gather(failing(1), failing(1), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results) and calls == [3, -1]
+        # ошибки не кешируются
+        await asyncio.gather(failing(1), return_exceptions=True)
+        assert calls == [3, -1, -1]
+        # отмена одного ожидающего не мешает остальным
+        first = asyncio.ensure_future(fetch(4))
+        second = asyncio.ensure_future(fetch(4))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == 8
+
+    asyncio.run(check_async())
+
+    # L2 в разделяемой памяти: второй «воркер» со своим L1 берёт результат из mmap
+    shared_path = os.path.join(
+        tempfile.gettempdir(), f"lru_cache_selfcheck_{os.getpid()}"
+    )
+    shared = MmapBackend(path=shared_path, slots=64, slot_size=256)
+    computed = []
+
+    def make_worker():
+        @lru_cache(maxsize=8, backend=shared, namespace="selfcheck.cube")
+        def cube(x: int) -> int:
+            computed.append(x)
+            return x**3
+
+        return cube
+
+    first, second = make_worker(), make_worker()
+    assert [first(i) for i in range(5)] == [second(i) for i in range(5)]
+    assert computed == list(range(5))
+    second.cache_clear()  # чистит и L1, и namespace в L2
+    assert first.cache_info().currsize == 5 and second(1) == 1 and computed[-1] == 1
+    # Очистка namespace не рвёт цепочку проб: ключ другого namespace за надгробием
+    # находится, и set обновляет его, а не пишет дубликат
+    key = b"\x00" * 8 + b"k" * 8
+    shared.clear()
+    shared.set("selfcheck.a", key[:8] + b"a" * 8, b"a", None)
+    shared.set("selfcheck.b", key, b"old", None)
+    shared.clear("selfcheck.a")
+    assert shared.get("selfcheck.b", key) == b"old"
+    shared.set("selfcheck.b", key, b"new", None)
+    shared.clear("selfcheck.b")
+    assert shared.get("selfcheck.b", key) is None
+    shared.close()
+    shared.unlink()
 
     print("Все тесты прошли успешно ✅")
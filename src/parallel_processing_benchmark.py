@@ -24,20 +24,114 @@
 #
 # Сохранение результатов:
 # Сохраните обработанные данные в файл (например, в формате JSON или CSV).
+#
+# Дополнительно: вариант "Sieve+lookup" строит решето Эратосфена один раз до max(data)
+# и классифицирует весь вход пакетной выборкой из таблицы. Результат — колонки
+# (array чисел, bytes флагов простоты) вместо списка словарей.
+# Вариант "SharedMemory" кладёт вход в multiprocessing.shared_memory: воркеры обходят
+# непрерывные диапазоны индексов и пишут флаги в общий выходной буфер, поэтому
+# per-element pickling отсутствует — по IPC ходят только пары (start, stop).
+#
+# Харнес: каждый вариант оформлен как раннер (контекстный менеджер) — вход поднимает
+# пул, выход останавливает, поэтому startup меряется отдельно от вычислений. Каждое
+# измерение идёт в свежем spawn-процессе (чистый peak RSS): warmup, повторы,
+# median/p95/stddev, свип по N и числу воркеров, проверка против однопоточного
+# эталона и отчёт в JSON/CSV.
+#
+# Потоковый режим (--stream): данные генерируются чанками, каждый чанк проходит через
+# выбранный раннер, а отдельный поток-писатель дописывает строки в JSONL/CSV или
+# компактный бинарный колоночный файл. В памяти одновременно не больше пары чанков,
+# поэтому потребление не зависит от N.
+#
+# Нагрузки (--workload): prime (исходная проверка делением), miller-rabin (64-битные
+# числа), factorial (битовая длина n!), sha256 (цепочка хешей). Диапазон данных
+# задаётся --low/--high. Плюс варианты asyncio + run_in_executor и
+# InterpreterPoolExecutor / free-threaded потоки — там, где их поддерживает рантайм.
 
 
+import argparse
+import asyncio
+import concurrent.futures
 import csv
+import hashlib
 import json
 import math
+import platform
+import queue
 import random
+import statistics
+import struct
+import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
-from multiprocessing import Pool, Process, Queue, cpu_count
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import repeat
+from multiprocessing import (
+    Pool,
+    Process,
+    Queue,
+    cpu_count,
+    get_context,
+    resource_tracker,
+    shared_memory,
+)
+from typing import Callable, Iterator, NamedTuple
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS не измеряем
+    resource = None
+
+DEFAULT_CHUNKSIZE = 10_000  # чисел на одну задачу в варианте SharedMemory
+STREAM_CHUNK_SIZE = 1_000_000  # чисел на чанк в потоковом режиме
+STREAM_QUEUE_SIZE = 2  # обработанных чанков в очереди к писателю
+STREAM_FORMATS = ("jsonl", "csv", "columnar")
+COLUMNAR_MAGIC = b"PPBC"
+COLUMNAR_VERSION = 1
+SIEVE_LIMIT = 100_000_000  # больше — таблица решета не влезает в разумную память
+HASH_ROUNDS = 1_000  # итераций sha256 на число
+INT64_MAX = 2**63 - 1
+
+
+class VariantUnavailable(RuntimeError):
+    # Вариант не поддерживается рантаймом или выбранной нагрузкой
+    pass
 
 
 # ---------- Сбор данных ----------
-def generate_data(n: int) -> list[int]:
-    return [random.randint(1, 1000) for _ in range(n)]
+def check_range(low: int, high: int):
+    # Числа хранятся в int64-колонках
+    if not 0 <= low <= high <= INT64_MAX:
+        raise ValueError(f"expected 0 <= low <= high <= 2**63-1, got {low}..{high}")
+
+
+def generate_data(
+    n: int, seed: int | None = None, low: int = 1, high: int = 1000
+) -> list[int]:
+    # seed нужен харнесу: каждое измерение в своём процессе получает те же данные
+    check_range(low, high)
+    rng = random if seed is None else random.Random(seed)
+    return [rng.randint(low, high) for _ in range(n)]
+
+
+def generate_chunks(
+    n: int,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    seed: int | None = None,
+    low: int = 1,
+    high: int = 1000,
+) -> Iterator[array]:
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be >= 1")
+    check_range(low, high)
+    rng = random if seed is None else random.Random(seed)
+    population = range(low, high + 1)
+    for start in range(0, n, chunk_size):
+        yield array("q", rng.choices(population, k=min(chunk_size, n - start)))
 
 
 # ---------- Обработка ----------
@@ -53,68 +147,360 @@ def is_prime(number: int) -> bool:
     return True
 
 
-def process_number(number: int) -> dict:
+_MR_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)  # детерминированно до 3.18e23
+
+
+def miller_rabin(number: int) -> bool:
+    if number < 2:
+        return False
+    for base in _MR_BASES:
+        if number % base == 0:
+            return number == base
+    d, s = number - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for base in _MR_BASES:
+        x = pow(base, d, number)
+        if x == 1 or x == number - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % number
+            if x == number - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def factorial_bits(number: int) -> int:
+    # Длинная арифметика: сам n! не возвращаем, только его битовую длину
+    return math.factorial(number).bit_length()
+
+
+def sha256_rounds(number: int) -> int:
+    digest = number.to_bytes(8, "little")
+    for _ in range(HASH_ROUNDS):
+        digest = hashlib.sha256(digest).digest()
+    return int.from_bytes(digest[:8], "little", signed=True)
+
+
+class Workload(NamedTuple):
+    func: Callable[[int], int]
+    field: str  # имя поля результата в строках/файлах
+    typecode: str  # тип колонки результата: "B" — флаг, "q" — int64
+
+
+WORKLOADS = {
+    "prime": Workload(is_prime, "is_prime", "B"),
+    "miller-rabin": Workload(miller_rabin, "is_prime", "B"),
+    "factorial": Workload(factorial_bits, "factorial_bits", "q"),
+    "sha256": Workload(sha256_rounds, "sha256", "q"),
+}
+
+
+def process_number(number: int, workload: str = "prime") -> dict:
     # Возвращаем словарь для сохранения
-    return {"number": number, "is_prime": is_prime(number)}
+    spec = WORKLOADS[workload]
+    return {"number": number, spec.field: spec.func(number)}
+
+
+def process_chunk(numbers, workload: str = "prime") -> array:
+    # Чанковые варианты: одна задача — кусок чисел, результат — колонка
+    spec = WORKLOADS[workload]
+    return array(spec.typecode, map(spec.func, numbers))
 
 
 # ---------- Варианты обработки ----------
 
 
+# Раннер — контекстный менеджер: вход поднимает пул, yield отдаёт run(data),
+# выход останавливает пул. Функции-варианты ниже — разовый запуск раннера.
+
+
 # Однопроцессный (без параллелизации)
-def single_threaded(data):
-    return [process_number(num) for num in data]
+def single_threaded(data, workload: str = "prime"):
+    return [process_number(num, workload) for num in data]
+
+
+@contextmanager
+def single_threaded_runner(workers: int | None = None, workload: str = "prime"):
+    yield partial(single_threaded, workload=workload)
 
 
 # Вариант А: ThreadPoolExecutor
+@contextmanager
+def thread_pool_runner(workers: int | None = None, workload: str = "prime"):
+    with ThreadPoolExecutor(max_workers=workers or cpu_count()) as executor:
+        yield lambda data: list(executor.map(process_number, data, repeat(workload)))
+
+
 def thread_pool(data):
-    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
-        return list(executor.map(process_number, data))
+    with thread_pool_runner() as run:
+        return run(data)
 
 
 # Вариант Б: multiprocessing.Pool
+@contextmanager
+def process_pool_runner(workers: int | None = None, workload: str = "prime"):
+    with Pool(processes=workers or cpu_count()) as pool:
+        yield partial(pool.map, partial(process_number, workload=workload))
+
+
 def process_pool(data):
-    with Pool(processes=cpu_count()) as pool:
-        return pool.map(process_number, data)
+    with process_pool_runner() as run:
+        return run(data)
 
 
 # Вариант В: multiprocessing.Process + Queue
-def worker(input_q: Queue, output_q: Queue):
+def worker(input_q: Queue, output_q: Queue, workload: str = "prime"):
     while True:
         num = input_q.get()
         if num is None:
             break
-        output_q.put(process_number(num))
+        output_q.put(process_number(num, workload))
 
 
-def process_with_queues(data):
+@contextmanager
+def queue_runner(workers: int | None = None, workload: str = "prime"):
     input_q = Queue()
     output_q = Queue()
 
     # Создаём процессы
     processes = [
-        Process(target=worker, args=(input_q, output_q)) for _ in range(cpu_count())
+        Process(target=worker, args=(input_q, output_q, workload))
+        for _ in range(workers or cpu_count())
     ]
 
     for p in processes:
         p.start()
 
-    # Кладём данные
-    for num in data:
-        input_q.put(num)
+    def run(data):
+        # Кладём данные
+        for num in data:
+            input_q.put(num)
+        return [output_q.get() for _ in range(len(data))]
 
-    # Посылаем сигналы на завершение
-    for _ in processes:
-        input_q.put(None)
+    try:
+        yield run
+    finally:
+        # Посылаем сигналы на завершение
+        for _ in processes:
+            input_q.put(None)
+        for p in processes:
+            p.join()
 
-    results = []
-    for _ in range(len(data)):
-        results.append(output_q.get())
 
-    for p in processes:
-        p.join()
-
-    return results
+def process_with_queues(data):
+    with queue_runner() as run:
+        return run(data)
+
+
+# Вариант Г: решето + табличная выборка, колоночный результат
+def prime_table(limit: int) -> bytearray:
+    # table[n] == 1, если n простое (решето Эратосфена)
+    table = bytearray([1]) * (limit + 1)
+    table[: min(2, limit + 1)] = bytes(min(2, limit + 1))
+    for i in range(2, math.isqrt(limit) + 1):
+        if table[i]:
+            table[i * i :: i] = bytes(len(range(i * i, limit + 1, i)))
+    return table
+
+
+def sieve_lookup(data) -> tuple[array, bytes]:
+    numbers = array("q", data)
+    if not numbers:
+        return numbers, b""
+    if max(numbers) > SIEVE_LIMIT:
+        raise VariantUnavailable(f"sieve needs max(data) <= {SIEVE_LIMIT}")
+    table = prime_table(max(numbers))
+    # map по встроенному __getitem__ — выборка из таблицы целиком на уровне C
+    flags = bytes(map(table.__getitem__, numbers))
+    return numbers, flags
+
+
+@contextmanager
+def sieve_runner(workers: int | None = None, workload: str = "prime"):
+    if workload != "prime":
+        raise VariantUnavailable("sieve supports only the prime workload")
+    yield sieve_lookup
+
+
+# Вариант Д: shared_memory + диапазоны индексов
+_shared = {}  # в воркере: подключённые сегменты и view на них
+
+
+def _attach_shared(input_name: str, output_name: str, length: int, typecode: str):
+    # Подключаемся к сегментам один раз на прогон: пул живёт дольше одного run()
+    if _shared.get("names") == (input_name, output_name):
+        return
+    _detach_shared()
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    _shared["names"] = (input_name, output_name)
+    _shared["segments"] = (input_shm, output_shm)
+    # Размер сегмента округляется до страницы — режем до длины данных
+    _shared["numbers"] = input_shm.buf[: length * 8].cast("q")
+    itemsize = array(typecode).itemsize
+    _shared["values"] = output_shm.buf[: length * itemsize].cast(typecode)
+
+
+def _detach_shared():
+    if "names" not in _shared:
+        return
+    _shared.pop("numbers").release()
+    _shared.pop("values").release()
+    for shm in _shared.pop("segments"):
+        shm.close()
+    del _shared["names"]
+
+
+def _process_range(task: tuple[str, str, int, str, int, int]):
+    input_name, output_name, length, workload, start, stop = task
+    _attach_shared(input_name, output_name, length, WORKLOADS[workload].typecode)
+    _shared["values"][start:stop] = process_chunk(
+        _shared["numbers"][start:stop], workload
+    )
+
+
+def _run_shared(pool, chunksize: int, workload: str, data) -> tuple[array, array]:
+    numbers = array("q", data)
+    values = array(WORKLOADS[workload].typecode)
+    length = len(numbers)
+    if not length:
+        return numbers, values
+
+    input_shm = shared_memory.SharedMemory(create=True, size=length * numbers.itemsize)
+    output_shm = shared_memory.SharedMemory(create=True, size=length * values.itemsize)
+    try:
+        input_shm.buf[: length * numbers.itemsize] = memoryview(numbers).cast("B")
+        tasks = [
+            (
+                input_shm.name,
+                output_shm.name,
+                length,
+                workload,
+                start,
+                min(start + chunksize, length),
+            )
+            for start in range(0, length, chunksize)
+        ]
+        pool.map(_process_range, tasks, chunksize=1)
+        values.frombytes(output_shm.buf[: length * values.itemsize])
+    finally:
+        # Сегменты создал родитель — он же их и удаляет
+        for shm in (input_shm, output_shm):
+            shm.close()
+            shm.unlink()
+    return numbers, values
+
+
+@contextmanager
+def shared_memory_runner(
+    workers: int | None = None,
+    workload: str = "prime",
+    chunksize: int = DEFAULT_CHUNKSIZE,
+):
+    if chunksize < 1:
+        raise ValueError("chunksize must be >= 1")
+    # Трекер поднимаем до форка пула: иначе каждый воркер заведёт свой и при выходе
+    # «подчистит» уже удалённые родителем сегменты с предупреждениями
+    resource_tracker.ensure_running()
+    with Pool(processes=workers or cpu_count()) as pool:
+        yield partial(_run_shared, pool, chunksize, workload)
+
+
+def shared_memory_pool(
+    data,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    processes: int | None = None,
+    workload: str = "prime",
+) -> tuple[array, array]:
+    with shared_memory_runner(processes, workload, chunksize) as run:
+        return run(data)
+
+
+# Чанковые варианты через executor: задача — кусок array, ответ — колонка
+def _split(numbers: array, chunksize: int) -> list[array]:
+    return [numbers[i : i + chunksize] for i in range(0, len(numbers), chunksize)]
+
+
+def _join(numbers: array, parts, workload: str) -> tuple[array, array]:
+    values = array(WORKLOADS[workload].typecode)
+    for part in parts:
+        values.extend(part)
+    return numbers, values
+
+
+def _run_chunked(executor, chunksize: int, workload: str, data):
+    numbers = array("q", data)
+    parts = executor.map(process_chunk, _split(numbers, chunksize), repeat(workload))
+    return _join(numbers, parts, workload)
+
+
+# Вариант Е: asyncio + run_in_executor поверх пула процессов
+async def _gather_chunks(executor, chunksize: int, workload: str, numbers: array):
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, process_chunk, part, workload)
+            for part in _split(numbers, chunksize)
+        )
+    )
+
+
+def _run_asyncio(executor, chunksize: int, workload: str, data):
+    numbers = array("q", data)
+    parts = asyncio.run(_gather_chunks(executor, chunksize, workload, numbers))
+    return _join(numbers, parts, workload)
+
+
+@contextmanager
+def asyncio_runner(
+    workers: int | None = None,
+    workload: str = "prime",
+    chunksize: int = DEFAULT_CHUNKSIZE,
+):
+    if chunksize < 1:
+        raise ValueError("chunksize must be >= 1")
+    with ProcessPoolExecutor(max_workers=workers or cpu_count()) as executor:
+        executor.submit(int).result()  # процессы стартуют лениво — поднимаем их здесь
+        yield partial(_run_asyncio, executor, chunksize, workload)
+
+
+# Вариант Ж: интерпретатор на ядро (3.14+) или потоки без GIL (free-threaded сборка)
+def gil_disabled() -> bool:
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+@contextmanager
+def interpreter_runner(
+    workers: int | None = None,
+    workload: str = "prime",
+    chunksize: int = DEFAULT_CHUNKSIZE,
+):
+    if chunksize < 1:
+        raise ValueError("chunksize must be >= 1")
+    if gil_disabled():
+        executor_class = ThreadPoolExecutor
+    else:
+        executor_class = getattr(concurrent.futures, "InterpreterPoolExecutor", None)
+        if executor_class is None:
+            raise VariantUnavailable(
+                "needs InterpreterPoolExecutor (Python 3.14+) or a free-threaded build"
+            )
+    with executor_class(max_workers=workers or cpu_count()) as executor:
+        yield partial(_run_chunked, executor, chunksize, workload)
+
+
+def columns_to_rows(numbers, values, workload: str = "prime") -> list[dict]:
+    spec = WORKLOADS[workload]
+    convert = bool if spec.typecode == "B" else int
+    return [
+        {"number": number, spec.field: convert(value)}
+        for number, value in zip(numbers, values)
+    ]
 
 
 # ---------- Сохранение ----------
@@ -123,9 +509,9 @@ def save_results_json(results, filename="results.json"):
         json.dump(results, f, ensure_ascii=False, indent=2)
 
 
-def save_results_csv(results, filename="results.csv"):
+def save_results_csv(results, filename="results.csv", workload: str = "prime"):
     with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["number", "is_prime"])
+        writer = csv.DictWriter(f, fieldnames=["number", WORKLOADS[workload].field])
         writer.writeheader()
         writer.writerows(results)
 
@@ -138,27 +524,479 @@ def benchmark(func, data, name):
     return name, elapsed, results
 
 
+# ---------- Потоковый конвейер ----------
+def to_columns(results, workload: str = "prime") -> tuple[array, array]:
+    # Приводим результат любого варианта к колонкам (числа, результаты)
+    if isinstance(results, tuple):
+        return results
+    spec = WORKLOADS[workload]
+    numbers = array("q", (row["number"] for row in results))
+    values = array(spec.typecode, (row[spec.field] for row in results))
+    return numbers, values
+
+
+_JSON_BOOL = ("false", "true")
+
+
+def _write_jsonl(f, field: str, encode, numbers, values):
+    f.writelines(
+        f'{{"number": {number}, "{field}": {encode(value)}}}\n'
+        for number, value in zip(numbers, values)
+    )
+
+
+def _little_endian(column):
+    if sys.byteorder != "little" and column.itemsize > 1:
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def _write_columnar_block(f, numbers, values):
+    # Блок: uint64 длина, затем колонка чисел и колонка результатов (little-endian)
+    f.write(struct.pack("<Q", len(numbers)))
+    f.write(_little_endian(numbers))
+    f.write(_little_endian(values))
+
+
+@contextmanager
+def open_sink(path: str, fmt: str, workload: str = "prime"):
+    # Отдаёт write(numbers, values), дописывающий чанк в файл
+    spec = WORKLOADS[workload]
+    is_flag = spec.typecode == "B"
+    if fmt == "jsonl":
+        with open(path, "w", encoding="utf-8") as f:
+            encode = _JSON_BOOL.__getitem__ if is_flag else str
+            yield partial(_write_jsonl, f, spec.field, encode)
+    elif fmt == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["number", spec.field])
+            convert = bool if is_flag else int
+            yield lambda numbers, values: writer.writerows(
+                zip(numbers, map(convert, values))
+            )
+    elif fmt == "columnar":
+        with open(path, "wb") as f:
+            f.write(
+                COLUMNAR_MAGIC
+                + struct.pack("<Bcc", COLUMNAR_VERSION, b"q", spec.typecode.encode())
+            )
+            yield partial(_write_columnar_block, f)
+    else:
+        raise ValueError(f"unknown format: {fmt!r}, expected one of {STREAM_FORMATS}")
+
+
+def read_columnar(path: str) -> Iterator[tuple[array, array]]:
+    with open(path, "rb") as f:
+        header = f.read(len(COLUMNAR_MAGIC) + 3)
+        if header[: len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+            raise ValueError(f"{path}: not a columnar results file")
+        version, number_code, value_code = struct.unpack(
+            "<Bcc", header[len(COLUMNAR_MAGIC) :]
+        )
+        if version != COLUMNAR_VERSION:
+            raise ValueError(f"{path}: unsupported version {version}")
+        while size := f.read(8):
+            (length,) = struct.unpack("<Q", size)
+            columns = []
+            for code in (number_code, value_code):
+                column = array(code.decode())
+                column.frombytes(f.read(length * column.itemsize))
+                columns.append(_little_endian(column))
+            yield tuple(columns)
+
+
+def stream_pipeline(
+    n: int,
+    path: str,
+    fmt: str = "jsonl",
+    variant: str = "shm",
+    workers: int | None = None,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    seed: int | None = None,
+    workload: str = "prime",
+    low: int = 1,
+    high: int = 1000,
+    **options,
+) -> int:
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"unknown format: {fmt!r}, expected one of {STREAM_FORMATS}")
+    pending = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    errors = []
+
+    def write_loop(write):
+        # Писатель в своём потоке: запись чанка k идёт параллельно с обработкой k+1
+        while (item := pending.get()) is not None:
+            if errors:
+                continue  # после ошибки только вычерпываем очередь, чтобы не встал продюсер
+            try:
+                write(*item)
+            except BaseException as e:
+                errors.append(e)
+
+    written = 0
+    with (
+        open_sink(path, fmt, workload) as write,
+        VARIANTS[variant].runner(workers, workload, **options) as run,
+    ):
+        writer = threading.Thread(target=write_loop, args=(write,), daemon=True)
+        writer.start()
+        try:
+            for chunk in generate_chunks(n, chunk_size, seed, low, high):
+                if errors:
+                    break
+                numbers, values = to_columns(run(chunk), workload)
+                pending.put((numbers, values))
+                written += len(numbers)
+        finally:
+            pending.put(None)
+            writer.join()
+    if errors:
+        raise errors[0]
+    return written
+
+
+# ---------- Харнес ----------
+class Variant(NamedTuple):
+    title: str
+    runner: object
+    parallel: bool  # зависит ли от числа воркеров
+    chunked: bool = False  # принимает chunksize
+
+
+VARIANTS = {
+    "single": Variant("Single-threaded", single_threaded_runner, False),
+    "threads": Variant("ThreadPoolExecutor", thread_pool_runner, True),
+    "pool": Variant("Multiprocessing.Pool", process_pool_runner, True),
+    "queues": Variant("Multiprocessing.Process+Queue", queue_runner, True),
+    "sieve": Variant("Sieve+lookup (columnar)", sieve_runner, False),
+    "shm": Variant("SharedMemory", shared_memory_runner, True, chunked=True),
+    "asyncio": Variant("asyncio+run_in_executor", asyncio_runner, True, chunked=True),
+    "interp": Variant(
+        "Interpreters/free-threaded", interpreter_runner, True, chunked=True
+    ),
+}
+
+REPORT_FIELDS = [
+    "variant",
+    "title",
+    "workload",
+    "low",
+    "high",
+    "n",
+    "workers",
+    "chunksize",
+    "warmup",
+    "repeats",
+    "startup_s",
+    "median_s",
+    "p95_s",
+    "stddev_s",
+    "min_s",
+    "peak_rss_mb",
+    "peak_rss_children_mb",
+    "matches_baseline",
+]
+
+
+def results_digest(results, workload: str = "prime") -> str:
+    # Сравниваем мультимножества пар (число, результат): порядок у Process+Queue
+    # не гарантирован, а колоночные варианты возвращают (array, array|bytes)
+    if isinstance(results, tuple):
+        pairs = zip(*results)
+    else:
+        field = WORKLOADS[workload].field
+        pairs = ((row["number"], int(row[field])) for row in results)
+    digest = hashlib.sha256()
+    for (number, value), count in sorted(Counter(pairs).items()):
+        digest.update(f"{number}:{value}:{count};".encode())
+    return digest.hexdigest()
+
+
+def peak_rss() -> dict:
+    if resource is None:
+        return {"peak_rss_mb": None, "peak_rss_children_mb": None}
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        / scale,
+    }
+
+
+def measure(
+    key: str,
+    n: int,
+    workers: int,
+    options: dict,
+    warmup: int,
+    repeats: int,
+    seed: int,
+    workload: str = "prime",
+    low: int = 1,
+    high: int = 1000,
+) -> dict:
+    # Выполняется в отдельном процессе: одно измерение одного варианта
+    data = generate_data(n, seed, low, high)
+    start = time.perf_counter()
+    with VARIANTS[key].runner(workers, workload, **options) as run:
+        startup = time.perf_counter() - start
+        for _ in range(warmup):
+            run(data)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results = run(data)
+            timings.append(time.perf_counter() - start)
+    return {
+        "startup_s": startup,
+        "timings": timings,
+        "digest": results_digest(results, workload),
+        **peak_rss(),
+    }
+
+
+def summarize(timings: list[float]) -> dict:
+    ordered = sorted(timings)
+    return {
+        "median_s": statistics.median(ordered),
+        "p95_s": ordered[math.ceil(0.95 * len(ordered)) - 1],  # nearest-rank
+        "stddev_s": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "min_s": ordered[0],
+    }
+
+
+def run_harness(
+    variants=tuple(VARIANTS),
+    sizes=(1_000_000,),
+    workers=(None,),
+    chunksizes=(DEFAULT_CHUNKSIZE,),
+    warmup: int = 1,
+    repeats: int = 5,
+    seed: int = 0,
+    workload: str = "prime",
+    low: int = 1,
+    high: int = 1000,
+    on_row=None,
+    on_skip=None,
+) -> list[dict]:
+    if repeats < 1:
+        raise ValueError("repeats must be >= 1")
+    unknown = set(variants) - set(VARIANTS)
+    if unknown:
+        raise ValueError(f"unknown variants: {sorted(unknown)}")
+    if workload not in WORKLOADS:
+        raise ValueError(f"unknown workload: {workload!r}")
+    check_range(low, high)
+    worker_counts = [count or cpu_count() for count in workers]
+    spawn = get_context("spawn")
+
+    rows = []
+    for n in sizes:
+        data = generate_data(n, seed, low, high)
+        baseline = results_digest(single_threaded(data, workload), workload)
+        del data
+        for key in variants:
+            variant = VARIANTS[key]
+            points = [
+                (count, chunksize)
+                for count in (worker_counts if variant.parallel else [1])
+                for chunksize in (chunksizes if variant.chunked else [None])
+            ]
+            for count, chunksize in points:
+                options = {} if chunksize is None else {"chunksize": chunksize}
+                title = (
+                    variant.title
+                    if chunksize is None
+                    else f"{variant.title} chunks={chunksize}"
+                )
+                # Свежий процесс на каждое измерение: peak RSS не копится между вариантами
+                try:
+                    with ProcessPoolExecutor(
+                        max_workers=1, mp_context=spawn
+                    ) as executor:
+                        measured = executor.submit(
+                            measure,
+                            key,
+                            n,
+                            count,
+                            options,
+                            warmup,
+                            repeats,
+                            seed,
+                            workload,
+                            low,
+                            high,
+                        ).result()
+                except VariantUnavailable as e:
+                    if on_skip:
+                        on_skip(title, str(e))
+                    break  # от воркеров и chunksize доступность не зависит
+                row = {
+                    "variant": key,
+                    "title": title,
+                    "workload": workload,
+                    "low": low,
+                    "high": high,
+                    "n": n,
+                    "workers": count,
+                    "chunksize": chunksize,
+                    "warmup": warmup,
+                    "repeats": repeats,
+                    "startup_s": measured["startup_s"],
+                    **summarize(measured["timings"]),
+                    "peak_rss_mb": measured["peak_rss_mb"],
+                    "peak_rss_children_mb": measured["peak_rss_children_mb"],
+                    "matches_baseline": measured["digest"] == baseline,
+                }
+                rows.append(row)
+                if on_row:
+                    on_row(row)
+    return rows
+
+
+def save_report_json(rows, filename="benchmark.json"):
+    meta = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": cpu_count(),
+        "gil_disabled": gil_disabled(),
+    }
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": rows}, f, ensure_ascii=False, indent=2)
+
+
+def save_report_csv(rows, filename="benchmark.csv"):
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_row(row: dict):
+    rss = "-" if row["peak_rss_mb"] is None else f"{row['peak_rss_mb']:.0f}"
+    print(
+        "{:<35} {:>10} {:>3} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>7} {:>4}".format(
+            row["title"],
+            row["n"],
+            row["workers"],
+            row["startup_s"],
+            row["median_s"],
+            row["p95_s"],
+            row["stddev_s"],
+            rss,
+            "ok" if row["matches_baseline"] else "FAIL",
+        )
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel processing benchmark")
+    parser.add_argument(
+        "--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS)
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1_000_000])
+    parser.add_argument("--workers", nargs="+", type=int, default=[cpu_count()])
+    parser.add_argument(
+        "--chunksizes", nargs="+", type=int, default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workload", choices=list(WORKLOADS), default="prime")
+    parser.add_argument("--low", type=int, default=1, help="нижняя граница данных")
+    parser.add_argument("--high", type=int, default=1000, help="верхняя граница данных")
+    parser.add_argument(
+        "--json", default="benchmark.json", help="отчёт JSON ('' — не писать)"
+    )
+    parser.add_argument(
+        "--csv", default="benchmark.csv", help="отчёт CSV ('' — не писать)"
+    )
+    parser.add_argument(
+        "--results",
+        default="results",
+        help="префикс для обработанных данных (.json/.csv, '' — не писать)",
+    )
+    stream = parser.add_argument_group("потоковый режим")
+    stream.add_argument(
+        "--stream", metavar="PATH", help="вместо харнеса прогнать конвейер в файл"
+    )
+    stream.add_argument("--format", choices=STREAM_FORMATS, default="jsonl")
+    stream.add_argument("--variant", choices=list(VARIANTS), default="shm")
+    stream.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    try:
+        check_range(args.low, args.high)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def run_stream(args):
+    n = args.sizes[-1]
+    start = time.perf_counter()
+    written = stream_pipeline(
+        n,
+        args.stream,
+        args.format,
+        args.variant,
+        args.workers[0],
+        args.chunk_size,
+        args.seed,
+        args.workload,
+        args.low,
+        args.high,
+        **({"chunksize": args.chunksizes[0]} if VARIANTS[args.variant].chunked else {}),
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{written} rows -> {args.stream} ({args.format}) in {elapsed:.3f} s, {written / elapsed:,.0f} rows/s"
+    )
+    rss = peak_rss()
+    if rss["peak_rss_mb"] is not None:
+        print(
+            f"peak RSS: {rss['peak_rss_mb']:.0f} MB, workers: {rss['peak_rss_children_mb']:.0f} MB"
+        )
+
+
 if __name__ == "__main__":
-    N = 1_000_000  # можно увеличить, чтобы эффект был заметнее
-    data = generate_data(N)
-
-    benchmarks = []
-    for func, name in [
-        (single_threaded, "Single-threaded"),
-        (thread_pool, "ThreadPoolExecutor"),
-        (process_pool, "Multiprocessing.Pool"),
-        (process_with_queues, "Multiprocessing.Process+Queue"),
-    ]:
-        print(f"Running {name}...")
-        name, elapsed, results = benchmark(func, data, name)
-        benchmarks.append((name, elapsed))
-        # Сохраняем только для последнего варианта
-        if name == "Multiprocessing.Process+Queue":
-            save_results_json(results)
-            save_results_csv(results)
-
-    print("\n=== Benchmark Results ===")
-    print("{:<35} {:>10}".format("Method", "Time, s"))
-    print("-" * 50)
-    for name, elapsed in benchmarks:
-        print("{:<35} {:>10.3f}".format(name, elapsed))
+    args = parse_args()
+    if args.stream:
+        run_stream(args)
+        sys.exit()
+
+    print("=== Benchmark Results ===")
+    print(
+        "{:<35} {:>10} {:>3} {:>9} {:>9} {:>9} {:>9} {:>7} {:>4}".format(
+            "Method", "N", "W", "Startup", "Median", "p95", "Stddev", "RSS MB", "Ok"
+        )
+    )
+    print("-" * 104)
+    rows = run_harness(
+        args.variants,
+        args.sizes,
+        args.workers,
+        args.chunksizes,
+        args.warmup,
+        args.repeats,
+        args.seed,
+        args.workload,
+        args.low,
+        args.high,
+        on_row=print_row,
+        on_skip=lambda title, reason: print(f"{title:<35} skipped: {reason}"),
+    )
+
+    if args.json:
+        save_report_json(rows, args.json)
+    if args.csv:
+        save_report_csv(rows, args.csv)
+    if args.results:
+        # Все варианты сверены с эталоном — сохраняем однопоточный результат
+        data = generate_data(args.sizes[-1], args.seed, args.low, args.high)
+        results = single_threaded(data, args.workload)
+        save_results_json(results, f"{args.results}.json")
+        save_results_csv(results, f"{args.results}.csv", args.workload)
@@ -1,11 +1,110 @@
 # Задача - Очередь
 # Реализуйте класс очереди который использует редис под капотом
+#
+# Пакетный режим: publish_many кладёт сообщения variadic RPUSH'ами в одном pipeline,
+# consume_many забирает до n сообщений одним LPOP key count. consume(timeout=...) и
+# consume_many(..., timeout=...) блокируются на BLPOP/BLMPOP вместо busy-poll.
+# iter_messages() — генератор, который тянет сообщения пачками; при закрытии
+# генератора невыданные сообщения возвращаются в голову очереди.
+#
+# Надёжная доставка (at-least-once):
+# - ReliableQueue: сообщение атомарно (Lua) переносится LMOVE в processing-список
+#   потребителя, и ему ставится дедлайн видимости в ZSET по времени сервера. ack()
+#   удаляет сообщения из processing-списка пачкой, reap() возвращает в очередь
+#   сообщения с истёкшим дедлайном (потребитель упал или завис).
+# - StreamQueue: то же на Redis Streams — XREADGROUP / XACK / XAUTOCLAIM.
 
 
 import json
+import math
+import os
+import socket
+import time
+import uuid
+from typing import Iterable, Iterator, NamedTuple
 
 import redis
 
+DEFAULT_BATCH_SIZE = 100
+MAX_PUSH_ARGS = 1000  # сообщений в одном RPUSH — не раздуваем одну команду
+DEFAULT_BLOCK_TIMEOUT = 1.0  # секунд ожидания в iter_messages между проверками
+DEFAULT_VISIBILITY_TIMEOUT = 30.0  # секунд на обработку до возврата в очередь
+DEFAULT_REAP_LIMIT = 1000  # сообщений на потребителя за один проход reap()
+
+# KEYS: очередь, processing, дедлайны, множество потребителей, heartbeat
+# ARGV: сколько забрать, visibility timeout, имя потребителя, TTL heartbeat в мс
+# (0 — не ставить), [уже перенесённое BLMOVE]
+CONSUME_LUA = """
+local now = redis.call('TIME')
+local deadline = tonumber(now[1]) + tonumber(now[2]) / 1e6 + tonumber(ARGV[2])
+redis.call('SADD', KEYS[4], ARGV[3])
+-- Перед BLMOVE: пока heartbeat жив, reap() не снимает потребителя с учёта,
+-- даже если его processing-список пуст
+if tonumber(ARGV[4]) > 0 then
+    redis.call('SET', KEYS[5], 1, 'PX', ARGV[4])
+end
+local out = {}
+for i = 5, #ARGV do
+    redis.call('ZADD', KEYS[3], deadline, ARGV[i])
+    out[#out + 1] = ARGV[i]
+end
+while #out < tonumber(ARGV[1]) do
+    local msg = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not msg then
+        break
+    end
+    redis.call('ZADD', KEYS[3], deadline, msg)
+    out[#out + 1] = msg
+end
+return out
+"""
+
+# KEYS: очередь, processing, дедлайны, множество потребителей, heartbeat
+# ARGV: лимит, visibility timeout, имя потребителя
+REAP_LUA = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1e6
+-- Потребитель упал между BLMOVE и ZADD: такие сообщения получают дедлайн сейчас
+for _, msg in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    redis.call('ZADD', KEYS[3], 'NX', now + tonumber(ARGV[2]), msg)
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now, 'LIMIT', 0, tonumber(ARGV[1]))
+local requeued = 0
+for _, msg in ipairs(expired) do
+    if redis.call('LREM', KEYS[2], 1, msg) > 0 then
+        -- В голову очереди: просроченные и так ждали дольше всех
+        redis.call('LPUSH', KEYS[1], msg)
+        requeued = requeued + 1
+    end
+    redis.call('ZREM', KEYS[3], msg)
+end
+-- Снимаем с учёта, только когда сообщений нет и потребитель не ждёт в BLMOVE:
+-- иначе сообщение, перенесённое после этой проверки, никто бы не вернул
+if redis.call('LLEN', KEYS[2]) == 0 and redis.call('EXISTS', KEYS[5]) == 0 then
+    redis.call('SREM', KEYS[4], ARGV[3])
+end
+return requeued
+"""
+
+# KEYS: очередь, processing, дедлайны; ARGV: сообщения
+REQUEUE_LUA = """
+local requeued = 0
+for i = #ARGV, 1, -1 do
+    if redis.call('LREM', KEYS[2], 1, ARGV[i]) > 0 then
+        redis.call('LPUSH', KEYS[1], ARGV[i])
+        requeued = requeued + 1
+    end
+    redis.call('ZREM', KEYS[3], ARGV[i])
+end
+return requeued
+"""
+
+
+class Message(NamedTuple):
+    id: str
+    body: dict
+    raw: str  # как сообщение лежит в Redis — по нему делается ack
+
 
 class RedisQueue:
     def __init__(
@@ -16,17 +115,338 @@ class RedisQueue:
         )
         self._name = name
 
+    def _encode(self, msg: dict) -> str:
+        return json.dumps(msg)
+
+    def _decode(self, msg_json: str):
+        return json.loads(msg_json)
+
+    def _requeue(self, msgs: list):
+        # Вернуть невыданные сообщения в голову очереди в исходном порядке
+        self._redis.lpush(self._name, *(self._encode(m) for m in reversed(msgs)))
+
     def publish(self, msg: dict):
         # Сериализуем словарь в JSON и добавляем в конец списка
-        msg_json = json.dumps(msg)
+        msg_json = self._encode(msg)
         self._redis.rpush(self._name, msg_json)
 
-    def consume(self) -> dict | None:
-        # Извлекаем JSON из начала списка и десериализуем в словарь
-        msg_json = self._redis.lpop(self._name)
+    def publish_many(self, msgs: Iterable[dict]) -> int:
+        # Один round trip на всю пачку: RPUSH по MAX_PUSH_ARGS сообщений в pipeline
+        pipe = self._redis.pipeline(transaction=False)
+        batch = []
+        count = 0
+        for msg in msgs:
+            batch.append(self._encode(msg))
+            if len(batch) >= MAX_PUSH_ARGS:
+                pipe.rpush(self._name, *batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            pipe.rpush(self._name, *batch)
+            count += len(batch)
+        if count:
+            pipe.execute()
+        return count
+
+    def consume(self, timeout: float | None = None) -> dict | None:
+        # Извлекаем JSON из начала списка и десериализуем в словарь.
+        # timeout=None — не ждать; иначе BLPOP ждёт до timeout секунд (0 — бесконечно)
+        if timeout is None:
+            msg_json = self._redis.lpop(self._name)
+        else:
+            popped = self._redis.blpop([self._name], timeout=timeout)
+            msg_json = popped[1] if popped else None
         if msg_json is None:
             return None
-        return json.loads(msg_json)
+        return self._decode(msg_json)
+
+    def consume_many(self, n: int, timeout: float | None = None) -> list[dict]:
+        # До n сообщений за один round trip; пустой список, если очередь пуста
+        if n < 1:
+            raise ValueError("n must be >= 1")
+        if timeout is None:
+            msgs_json = self._redis.lpop(self._name, n)
+        else:
+            # BLMPOP (Redis 7+) ждёт первое сообщение и забирает до n сразу
+            popped = self._redis.blmpop(
+                timeout, 1, self._name, direction="LEFT", count=n
+            )
+            msgs_json = popped[1] if popped else None
+        if not msgs_json:
+            return []
+        return [self._decode(msg_json) for msg_json in msgs_json]
+
+    def iter_messages(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        timeout: float = DEFAULT_BLOCK_TIMEOUT,
+        stop_when_empty: bool = False,
+    ) -> Iterator[dict]:
+        # Сообщения забираются пачками по batch_size; пока пачка не выдана целиком,
+        # Redis не трогаем. Пустая очередь — блокирующее ожидание по timeout секунд.
+        while True:
+            batch = self.consume_many(batch_size)
+            if not batch:
+                if stop_when_empty:
+                    return
+                batch = self.consume_many(batch_size, timeout=timeout)
+            for index, msg in enumerate(batch):
+                try:
+                    yield msg
+                except GeneratorExit:
+                    # Генератор закрыли посреди пачки — возвращаем остаток в голову очереди
+                    rest = batch[index + 1 :]
+                    if rest:
+                        self._requeue(rest)
+                    raise
+
+    def __len__(self) -> int:
+        return self._redis.llen(self._name)
+
+
+def default_consumer_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class ReliableQueue(RedisQueue):
+    # consume*/iter_messages отдают Message; пока нет ack, сообщение лежит в
+    # "<name>:processing:<consumer>" и вернётся в очередь после visibility_timeout
+    def __init__(
+        self,
+        name="queue",
+        redis_host="localhost",
+        redis_port=6379,
+        redis_db=0,
+        consumer: str | None = None,
+        visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+    ):
+        super().__init__(name, redis_host, redis_port, redis_db)
+        self.consumer = consumer or default_consumer_name()
+        self.visibility_timeout = visibility_timeout
+        self._consumers_key = f"{name}:consumers"
+        self._processing = self._processing_key(self.consumer)
+        self._deadlines = self._deadlines_key(self.consumer)
+        self._heartbeat = self._heartbeat_key(self.consumer)
+        self._consume_script = self._redis.register_script(CONSUME_LUA)
+        self._reap_script = self._redis.register_script(REAP_LUA)
+        self._requeue_script = self._redis.register_script(REQUEUE_LUA)
+
+    def _processing_key(self, consumer: str) -> str:
+        return f"{self._name}:processing:{consumer}"
+
+    def _deadlines_key(self, consumer: str) -> str:
+        return f"{self._name}:deadlines:{consumer}"
+
+    def _heartbeat_key(self, consumer: str) -> str:
+        return f"{self._name}:heartbeat:{consumer}"
+
+    def _encode(self, msg: dict) -> str:
+        # Уникальный id в конверте: одинаковые тела должны оставаться разными сообщениями
+        return json.dumps({"id": uuid.uuid4().hex, "body": msg})
+
+    def _decode(self, msg_json: str) -> Message:
+        envelope = json.loads(msg_json)
+        return Message(envelope["id"], envelope["body"], msg_json)
+
+    def _requeue(self, msgs: list[Message]):
+        self._requeue_script(
+            keys=[self._name, self._processing, self._deadlines],
+            args=[msg.raw for msg in msgs],
+        )
+
+    def _claim(self, n: int, moved: list[str], block: float = 0) -> list[Message]:
+        # block — сколько секунд потребитель затем проведёт в BLMOVE; heartbeat
+        # переживает его на visibility_timeout, чтобы reap() успел увидеть сообщение
+        heartbeat_ms = (
+            math.ceil((block + self.visibility_timeout) * 1000) if block else 0
+        )
+        msgs_json = self._consume_script(
+            keys=[
+                self._name,
+                self._processing,
+                self._deadlines,
+                self._consumers_key,
+                self._heartbeat,
+            ],
+            args=[n, self.visibility_timeout, self.consumer, heartbeat_ms, *moved],
+        )
+        return [self._decode(msg_json) for msg_json in msgs_json]
+
+    def consume(self, timeout: float | None = None) -> Message | None:
+        msgs = self.consume_many(1, timeout)
+        return msgs[0] if msgs else None
+
+    def consume_many(self, n: int, timeout: float | None = None) -> list[Message]:
+        if n < 1:
+            raise ValueError("n must be >= 1")
+        if timeout is None:
+            return self._claim(n, [])
+        # Скрипт не может блокироваться: ждём первое сообщение BLMOVE, остальное
+        # (дедлайн для него и добор до n) — тем же атомарным скриптом. Ждём отрезками
+        # не длиннее visibility_timeout, чтобы heartbeat был конечным и при timeout=0
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            block = self.visibility_timeout
+            if deadline is not None:
+                block = min(block, deadline - time.monotonic())
+            msgs = self._claim(n, [], max(block, 0.001))
+            if msgs or block <= 0:
+                return msgs
+            msg_json = self._redis.blmove(
+                self._name, self._processing, block, src="LEFT", dest="RIGHT"
+            )
+            if msg_json is not None:
+                return self._claim(n, [msg_json])
+
+    def ack(self, msgs: Message | Iterable[Message]) -> int:
+        # Пачка ack — один round trip
+        if isinstance(msgs, Message):
+            msgs = [msgs]
+        pipe = self._redis.pipeline(transaction=False)
+        count = 0
+        for msg in msgs:
+            pipe.lrem(self._processing, 1, msg.raw)
+            pipe.zrem(self._deadlines, msg.raw)
+            count += 1
+        if not count:
+            return 0
+        return sum(pipe.execute()[::2])
+
+    def nack(self, msgs: Message | Iterable[Message]) -> int:
+        # Вернуть сообщения в очередь сразу, не дожидаясь visibility timeout
+        if isinstance(msgs, Message):
+            msgs = [msgs]
+        return self._requeue_script(
+            keys=[self._name, self._processing, self._deadlines],
+            args=[msg.raw for msg in msgs],
+        )
+
+    def extend(self, msgs: Message | Iterable[Message], timeout: float | None = None):
+        # Продлить видимость для долгой обработки (отсчёт от текущего времени сервера)
+        if isinstance(msgs, Message):
+            msgs = [msgs]
+        seconds, micros = self._redis.time()
+        deadline = seconds + micros / 1e6 + (timeout or self.visibility_timeout)
+        mapping = {msg.raw: deadline for msg in msgs}
+        if mapping:
+            self._redis.zadd(self._deadlines, mapping, xx=True)
+
+    def reap(self, limit: int = DEFAULT_REAP_LIMIT) -> int:
+        # Вернуть в очередь просроченные сообщения всех потребителей; запускать
+        # периодически (из любого процесса), возвращает число возвращённых сообщений
+        requeued = 0
+        for consumer in self._redis.smembers(self._consumers_key):
+            requeued += self._reap_script(
+                keys=[
+                    self._name,
+                    self._processing_key(consumer),
+                    self._deadlines_key(consumer),
+                    self._consumers_key,
+                    self._heartbeat_key(consumer),
+                ],
+                args=[limit, self.visibility_timeout, consumer],
+            )
+        return requeued
+
+
+class StreamQueue:
+    # Та же надёжная доставка на Redis Streams: группа потребителей, XACK,
+    # и XAUTOCLAIM для сообщений, которые висят у упавших потребителей дольше min_idle
+    def __init__(
+        self,
+        name="queue",
+        group="workers",
+        consumer: str | None = None,
+        redis_host="localhost",
+        redis_port=6379,
+        redis_db=0,
+        maxlen: int | None = None,
+    ):
+        self._redis = redis.Redis(
+            host=redis_host, port=redis_port, db=redis_db, decode_responses=True
+        )
+        self._name = name
+        self._group = group
+        self.consumer = consumer or default_consumer_name()
+        self._maxlen = maxlen
+        try:
+            self._redis.xgroup_create(name, group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _message(self, entry_id: str, fields: dict) -> Message:
+        return Message(entry_id, json.loads(fields["msg"]), entry_id)
+
+    def publish(self, msg: dict) -> str:
+        return self._redis.xadd(
+            self._name, {"msg": json.dumps(msg)}, maxlen=self._maxlen, approximate=True
+        )
+
+    def publish_many(self, msgs: Iterable[dict]) -> int:
+        pipe = self._redis.pipeline(transaction=False)
+        count = 0
+        for msg in msgs:
+            pipe.xadd(
+                self._name,
+                {"msg": json.dumps(msg)},
+                maxlen=self._maxlen,
+                approximate=True,
+            )
+            count += 1
+        if count:
+            pipe.execute()
+        return count
+
+    def consume(self, timeout: float | None = None) -> Message | None:
+        msgs = self.consume_many(1, timeout)
+        return msgs[0] if msgs else None
+
+    def consume_many(self, n: int, timeout: float | None = None) -> list[Message]:
+        if n < 1:
+            raise ValueError("n must be >= 1")
+        block = None if timeout is None else int(timeout * 1000)
+        response = self._redis.xreadgroup(
+            self._group, self.consumer, {self._name: ">"}, count=n, block=block
+        )
+        if not response:
+            return []
+        _, entries = response[0]
+        return [self._message(entry_id, fields) for entry_id, fields in entries]
+
+    def ack(self, msgs: Message | Iterable[Message]) -> int:
+        if isinstance(msgs, Message):
+            msgs = [msgs]
+        ids = [msg.id for msg in msgs]
+        return self._redis.xack(self._name, self._group, *ids) if ids else 0
+
+    def claim_stale(
+        self,
+        min_idle: float = DEFAULT_VISIBILITY_TIMEOUT,
+        count: int = DEFAULT_BATCH_SIZE,
+    ) -> list[Message]:
+        # Забрать себе сообщения, не подтверждённые дольше min_idle секунд
+        claimed = []
+        start = "0-0"
+        while len(claimed) < count:
+            response = self._redis.xautoclaim(
+                self._name,
+                self._group,
+                self.consumer,
+                int(min_idle * 1000),
+                start_id=start,
+                count=count - len(claimed),
+            )
+            start, entries = response[0], response[1]
+            # Удалённые из стрима записи приходят как None — их подтверждать нечем
+            claimed.extend(
+                self._message(entry_id, fields)
+                for entry_id, fields in entries
+                if fields
+            )
+            if start == "0-0":
+                break
+        return claimed
 
 
 if __name__ == "__main__":
@@ -38,3 +458,41 @@ if __name__ == "__main__":
     assert q.consume() == {"a": 1}
     assert q.consume() == {"b": 2}
     assert q.consume() == {"c": 3}
+
+    assert q.publish_many({"n": i} for i in range(2500)) == 2500
+    assert q.consume_many(3) == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert q.consume_many(10, timeout=0.1)[0] == {"n": 3}
+
+    messages = q.iter_messages(batch_size=100)
+    assert [next(messages) for _ in range(5)] == [{"n": i} for i in range(13, 18)]
+    messages.close()  # невыданные 95 сообщений из пачки вернулись в очередь
+    assert q.consume() == {"n": 18}
+    assert len(list(q.iter_messages(batch_size=64, stop_when_empty=True))) == 2500 - 19
+
+    assert q.consume(timeout=0.1) is None
+    assert q.consume_many(5, timeout=0.1) == []
+
+    # Надёжный режим: без ack сообщение возвращается в очередь после visibility timeout
+    rq = ReliableQueue("reliable", consumer="worker-1", visibility_timeout=0.2)
+    rq.publish_many([{"job": 1}, {"job": 2}, {"job": 3}])
+    first, second = rq.consume_many(2)
+    assert (first.body, second.body) == ({"job": 1}, {"job": 2})
+    assert rq.ack([first]) == 1
+    assert rq.reap() == 0  # дедлайн ещё не наступил
+    time.sleep(0.3)
+    assert rq.reap() == 1  # second не подтвердили — вернулся в голову очереди
+    other = ReliableQueue("reliable", consumer="worker-2", visibility_timeout=0.2)
+    redelivered = other.consume_many(5, timeout=0.1)
+    assert [m.body for m in redelivered] == [{"job": 2}, {"job": 3}]
+    assert redelivered[0].id == second.id
+    assert other.ack(redelivered) == 2
+    assert other.consume(timeout=0.1) is None
+
+    sq = StreamQueue("stream", consumer="worker-1")
+    sq.publish_many({"job": i} for i in range(3))
+    batch = sq.consume_many(10)
+    assert [m.body for m in batch] == [{"job": i} for i in range(3)]
+    assert sq.ack(batch[:2]) == 2
+    time.sleep(0.1)
+    stale = StreamQueue("stream", consumer="worker-2").claim_stale(min_idle=0.05)
+    assert [m.id for m in stale] == [batch[2].id]
@@ -0,0 +1,80 @@
+# Бенчмарк RedisQueue: сообщений в секунду на публикацию и чтение при разных размерах пачки.
+#
+# Размер пачки 1 — исходные publish/consume (один round trip на сообщение), дальше
+# publish_many / consume_many и генератор iter_messages. Нужен локальный redis-server.
+#
+# Запуск: uv run python redis_queue_benchmark.py
+
+
+import time
+
+from redis_queue import RedisQueue
+
+MESSAGES = 50_000
+BATCH_SIZES = [1, 10, 100, 1000]
+QUEUE_NAME = "queue:benchmark"
+
+
+def make_message(i: int) -> dict:
+    return {"id": i, "event": "rate.updated", "base": "USD", "value": 1.2345}
+
+
+def publish(queue: RedisQueue, batch_size: int) -> float:
+    start = time.perf_counter()
+    if batch_size == 1:
+        for i in range(MESSAGES):
+            queue.publish(make_message(i))
+    else:
+        for offset in range(0, MESSAGES, batch_size):
+            queue.publish_many(
+                make_message(i)
+                for i in range(offset, min(offset + batch_size, MESSAGES))
+            )
+    return time.perf_counter() - start
+
+
+def consume(queue: RedisQueue, batch_size: int) -> float:
+    start = time.perf_counter()
+    received = 0
+    if batch_size == 1:
+        while queue.consume() is not None:
+            received += 1
+    else:
+        while batch := queue.consume_many(batch_size):
+            received += len(batch)
+    assert received == MESSAGES
+    return time.perf_counter() - start
+
+
+def iterate(queue: RedisQueue, batch_size: int) -> float:
+    start = time.perf_counter()
+    received = sum(1 for _ in queue.iter_messages(batch_size, stop_when_empty=True))
+    assert received == MESSAGES
+    return time.perf_counter() - start
+
+
+def main():
+    queue = RedisQueue(QUEUE_NAME)
+    queue._redis.delete(QUEUE_NAME)
+    print(
+        "{:<16} {:>8} {:>10} {:>12}".format("Operation", "Batch", "Time, s", "msgs/s")
+    )
+    print("-" * 50)
+    for batch_size in BATCH_SIZES:
+        for name, reader in [("consume", consume), ("iter_messages", iterate)]:
+            if reader is iterate and batch_size == 1:
+                continue
+            rows = [
+                ("publish", publish(queue, batch_size)),
+                (name, reader(queue, batch_size)),
+            ]
+            for operation, elapsed in rows:
+                print(
+                    "{:<16} {:>8} {:>10.3f} {:>12,.0f}".format(
+                        operation, batch_size, elapsed, MESSAGES / elapsed
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
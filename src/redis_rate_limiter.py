@@ -6,65 +6,758 @@
 # 1) возвращает True в случае если лимит на кол-во запросов не достигнут
 # 2) возвращает False если за последние 3 секунды уже сделано 5 запросов.
 # Ваша реализация должна использовать Redis, т.к. предполагается что приложение работает на нескольких серверах.
+#
+# Каждая проверка — один вызов Lua-скрипта (EVALSHA, при NOSCRIPT redis-py сам
+# перезагружает скрипт): атомарно и за один round trip. Время берётся на сервере
+# (TIME), так что часы серверов приложения не должны совпадать. Алгоритмы:
+# - sliding_log: точное скользящее окно на ZSET, записываются только пропущенные запросы;
+# - sliding_window: два счётчика фиксированных окон со взвешиванием, O(1) памяти;
+# - token_bucket: ведро на limit токенов, пополняется со скоростью limit/period, O(1);
+# - gcra: одно число (TAT) на ключ, O(1), то же поведение, что у token_bucket.
+# check() кроме решения возвращает retry_after — через сколько секунд запрос пройдёт.
+# Разные алгоритмы хранят разные типы данных, поэтому ключ нельзя переиспользовать
+# между ними.
+#
+# Ключ и политика (Limit или имя тарифа из policies) задаются на каждый вызов, так что
+# одного RateLimiter хватает на всех клиентов. check_many() проверяет несколько ключей
+# (пользователь + IP + глобальный) одним скриптом: запрос учитывается во всех лимитах,
+# только если проходит все. acquire() ждёт retry_after вместо исключения;
+# AsyncRateLimiter — то же для asyncio (aiohttp/ASGI).
 
 
+import asyncio
+import math
+import os
 import random
+import socket
+import threading
 import time
+import uuid
+import weakref
+from typing import Mapping, NamedTuple
 
 import redis
+import redis.asyncio
+
+# Общая часть скриптов: алгоритм(key, limit, period в мкс, cost) возвращает
+# ok, остаток, ожидание в мкс и функцию, которая записывает пропущенный запрос.
+ALGORITHMS_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1e6 + tonumber(t[2])
+local stamp = t[1] .. '.' .. t[2]
+
+local function sliding_log(key, limit, period, cost)
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - period)
+    local count = redis.call('ZCARD', key)
+    if count + cost > limit then
+        -- Ждём, пока из окна выпадет столько старых запросов, сколько не хватает
+        local index = count + cost - limit - 1
+        local oldest = redis.call('ZRANGE', key, index, index, 'WITHSCORES')
+        return false, limit - count, tonumber(oldest[2]) + period - now
+    end
+    return true, limit - count - cost, 0, function()
+        for i = 1, cost do
+            -- Время + порядковый номер: уникально даже для запросов в одну микросекунду
+            redis.call('ZADD', key, now, stamp .. ':' .. (count + i))
+        end
+        redis.call('PEXPIRE', key, math.ceil(period / 1000))
+    end
+end
+
+local function sliding_window(key, limit, period, cost)
+    local window = math.floor(now / period)
+    local elapsed = now - window * period
+    local state = redis.call('HMGET', key, 'window', 'current', 'previous')
+    local current, previous = tonumber(state[2]) or 0, tonumber(state[3]) or 0
+    local stored = tonumber(state[1])
+    if stored ~= window then
+        previous = (stored == window - 1) and current or 0
+        current = 0
+    end
+    -- Предыдущее окно учитывается пропорционально своей доле в скользящем окне
+    local weighted = previous * (1 - elapsed / period) + current
+    if weighted + cost > limit then
+        local wait
+        if current + cost > limit then
+            -- До конца окна, а там текущее станет предыдущим и должно "остыть"
+            wait = period - elapsed + period * (1 - (limit - cost) / current)
+        else
+            wait = period * (1 - (limit - cost - current) / previous) - elapsed
+        end
+        return false, limit - weighted, wait
+    end
+    return true, limit - weighted - cost, 0, function()
+        redis.call('HSET', key, 'window', window, 'current', current + cost, 'previous', previous)
+        redis.call('PEXPIRE', key, math.ceil(2 * period / 1000))
+    end
+end
+
+local function token_bucket(key, limit, period, cost)
+    local rate = limit / period
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or limit
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(limit, tokens + math.max(0, now - ts) * rate)
+    if tokens < cost then
+        return false, tokens, (cost - tokens) / rate
+    end
+    return true, tokens - cost, 0, function()
+        redis.call('HSET', key, 'tokens', tokens - cost, 'ts', now)
+        -- Полное ведро равносильно отсутствию ключа
+        redis.call('PEXPIRE', key, math.ceil((limit - tokens + cost) / rate / 1000) + 1)
+    end
+end
+
+local function gcra(key, limit, period, cost)
+    -- TAT (theoretical arrival time): когда ведро опустеет при текущей нагрузке
+    local interval = period / limit
+    local tat = math.max(tonumber(redis.call('GET', key)) or now, now)
+    local new_tat = tat + cost * interval
+    local allow_at = new_tat - period
+    if now < allow_at then
+        return false, (now - (tat - period)) / interval, allow_at - now
+    end
+    return true, (now - allow_at) / interval, 0, function()
+        redis.call('SET', key, string.format('%d', new_tat), 'PX', math.ceil((new_tat - now) / 1000) + 1)
+    end
+end
+
+local algorithms = {
+    sliding_log = sliding_log,
+    sliding_window = sliding_window,
+    token_bucket = token_bucket,
+    gcra = gcra,
+}
+"""
+
+# KEYS — ключи лимитов; ARGV: cost, затем по тройке (algorithm, limit, period в сек)
+# на ключ. Сначала все проверки, потом запись — только если прошли все.
+# Возвращает {allowed, remaining, retry_after в микросекундах (-1 — никогда)}
+# по самому строгому из лимитов.
+RATE_LIMIT_LUA = (
+    ALGORITHMS_LUA
+    + """
+local cost = tonumber(ARGV[1])
+local allowed, remaining, retry = true, nil, 0
+local commits = {}
+for i, key in ipairs(KEYS) do
+    local algorithm = algorithms[ARGV[3 * i - 1]]
+    local limit = tonumber(ARGV[3 * i])
+    local period = tonumber(ARGV[3 * i + 1]) * 1e6
+    if cost > limit then
+        return {0, 0, -1}
+    end
+    local ok, left, wait, commit = algorithm(key, limit, period, cost)
+    left = math.max(0, math.floor(left))
+    remaining = remaining and math.min(remaining, left) or left
+    if ok then
+        commits[#commits + 1] = commit
+    else
+        allowed = false
+        retry = math.max(retry, math.ceil(wait))
+    end
+end
+if not allowed then
+    return {0, remaining, retry}
+end
+for _, commit in ipairs(commits) do
+    commit()
+end
+return {1, remaining, 0}
+"""
+)
+
+# Аренда для LeasedRateLimiter. KEYS: ключ лимита, хэш аренд (держатель -> "размер:дедлайн").
+# ARGV: algorithm, limit, period, cost, сколько хотим взять в запас, сколько всего
+# разрешений может быть на руках у всех держателей, держатель, срок аренды (сек).
+# Запас урезается до свободного бюджета и до того, что лимит даёт прямо сейчас.
+# Возвращает {allowed, взято в запас, remaining, retry_after в мкс, время аренды в мкс}.
+LEASE_LUA = (
+    ALGORITHMS_LUA
+    + """
+local key, leases = KEYS[1], KEYS[2]
+local algorithm = algorithms[ARGV[1]]
+local limit = tonumber(ARGV[2])
+local period = tonumber(ARGV[3]) * 1e6
+local cost = tonumber(ARGV[4])
+local holder = ARGV[7]
+local lease_ttl = tonumber(ARGV[8]) * 1e6
+if cost > limit then
+    return {0, 0, 0, -1, now}
+end
+-- Прошлая аренда держателя уже израсходована или брошена, просроченные не считаются
+local outstanding = 0
+local entries = redis.call('HGETALL', leases)
+for i = 1, #entries, 2 do
+    local size, deadline = string.match(entries[i + 1], '(%d+):(%d+)')
+    if entries[i] == holder or tonumber(deadline) <= now then
+        redis.call('HDEL', leases, entries[i])
+    else
+        outstanding = outstanding + tonumber(size)
+    end
+end
+local extra = math.max(0, math.min(tonumber(ARGV[5]), tonumber(ARGV[6]) - outstanding, limit - cost))
+local ok, left, wait, commit = algorithm(key, limit, period, cost + extra)
+if not ok and extra > 0 then
+    extra = math.max(0, math.floor(left) - cost)
+    ok, left, wait, commit = algorithm(key, limit, period, cost + extra)
+end
+if not ok then
+    return {0, 0, math.max(0, math.floor(left)), math.ceil(wait), now}
+end
+commit()
+if extra > 0 then
+    redis.call('HSET', leases, holder, extra .. ':' .. string.format('%d', now + lease_ttl))
+    redis.call('PEXPIRE', leases, math.ceil(lease_ttl / 1000) + 1)
+end
+return {1, extra, math.max(0, math.floor(left)), 0, now}
+"""
+)
+
+# Возврат неизрасходованной аренды. KEYS: ключ лимита, хэш аренд.
+# ARGV: algorithm, limit, period, сколько вернуть, время аренды (мкс), держатель.
+REFUND_LUA = """
+local key, leases = KEYS[1], KEYS[2]
+local limit = tonumber(ARGV[2])
+local period = tonumber(ARGV[3]) * 1e6
+local n = tonumber(ARGV[4])
+local leased_at = tonumber(ARGV[5])
+redis.call('HDEL', leases, ARGV[6])
+if ARGV[1] == 'sliding_log' then
+    -- Аренда записана n+cost отметками со временем аренды
+    local members = redis.call('ZRANGEBYSCORE', key, leased_at, leased_at, 'LIMIT', 0, n)
+    if #members > 0 then
+        redis.call('ZREM', key, unpack(members))
+    end
+elseif ARGV[1] == 'sliding_window' then
+    -- Вернуть можно только в то же окно: после смены окна запас уже "остывает"
+    if tonumber(redis.call('HGET', key, 'window')) == math.floor(leased_at / period) then
+        local current = tonumber(redis.call('HGET', key, 'current'))
+        redis.call('HSET', key, 'current', math.max(0, current - n))
+    end
+elseif ARGV[1] == 'token_bucket' then
+    local tokens = tonumber(redis.call('HGET', key, 'tokens'))
+    if tokens then
+        redis.call('HSET', key, 'tokens', math.min(limit, tokens + n))
+    end
+else
+    local tat = tonumber(redis.call('GET', key))
+    if tat then
+        local t = redis.call('TIME')
+        local now = tonumber(t[1]) * 1e6 + tonumber(t[2])
+        tat = tat - n * period / limit
+        if tat <= now then
+            redis.call('DEL', key)
+        else
+            redis.call('SET', key, string.format('%d', tat), 'PX', math.ceil((tat - now) / 1000) + 1)
+        end
+    end
+end
+return 1
+"""
+
+ALGORITHMS = ("sliding_log", "sliding_window", "token_bucket", "gcra")
+DEFAULT_MAX_OVERSHOOT = 0.1  # доля limit, которая может быть на руках у всех процессов
+LEASE_RATE_SMOOTHING = 0.5  # вес нового замера в EWMA скорости для размера аренды
+# Хэши аренд LeasedRateLimiter; ключи лимитов с этим префиксом запрещены, чтобы
+# хэш аренд одного ключа не совпал с другим ключом лимита
+LEASES_PREFIX = "rate_limiter:leases:"
+
+
+class Limit(NamedTuple):
+    limit: int
+    period: float
+    algorithm: str = "sliding_log"
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float  # секунд до пропуска; 0 — пропущен, -1 — cost больше limit
 
 
 class RateLimitExceed(Exception):
-    pass
+    def __init__(self, retry_after: float = 0.0):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
 
 
-class RateLimiter:
-    def __init__(self, redis_client=None, key="rate_limiter", limit=5, period=3):
-        if redis_client is None:
-            # По-умолчанию подключаемся к localhost
-            self.redis = redis.Redis(host="localhost", port=6379, db=0)
-        else:
-            self.redis = redis_client
+def _check_key(key: str):
+    if key.startswith(LEASES_PREFIX):
+        raise ValueError(f"keys starting with {LEASES_PREFIX!r} are reserved")
+
+
+def _leases_key(key: str) -> str:
+    return LEASES_PREFIX + key
+
+
+class _BaseRateLimiter:
+    def __init__(self, redis_client, key, limit, period, algorithm, policies):
+        self.redis = redis_client
         self.key = key
         self.limit = limit
         self.period = period
+        self.algorithm = algorithm
+        self.policy = self._validate(Limit(limit, period, algorithm))
+        # Тарифы: имя -> Limit, например {"free": Limit(10, 60), "pro": Limit(1000, 60)}
+        self.policies = {
+            name: self._validate(policy) for name, policy in (policies or {}).items()
+        }
+        self._script = self.redis.register_script(RATE_LIMIT_LUA)
+
+    @staticmethod
+    def _validate(policy: Limit) -> Limit:
+        if policy.algorithm not in ALGORITHMS:
+            raise ValueError(
+                f"unknown algorithm {policy.algorithm!r}, expected one of {ALGORITHMS}"
+            )
+        if policy.limit < 1 or policy.period <= 0:
+            raise ValueError("limit must be >= 1 and period > 0")
+        return policy
+
+    def _policy(self, policy: Limit | str | None) -> Limit:
+        if policy is None:
+            return self.policy
+        if isinstance(policy, str):
+            return self.policies[policy]
+        return self._validate(policy)
+
+    def _call_args(
+        self, checks: Mapping[str, Limit | str | None], cost: int
+    ) -> tuple[list, list]:
+        if not checks:
+            raise ValueError("at least one key is required")
+        keys, args = [], [cost]
+        for key, policy in checks.items():
+            _check_key(key)
+            limit, period, algorithm = self._policy(policy)
+            keys.append(key)
+            args.extend((algorithm, limit, period))
+        return keys, args
+
+    @staticmethod
+    def _result(reply) -> RateLimitResult:
+        allowed, remaining, retry_after = reply
+        if retry_after > 0:
+            retry_after /= 1_000_000
+        return RateLimitResult(bool(allowed), remaining, retry_after)
+
+    @staticmethod
+    def _next_wait(result: RateLimitResult, deadline: float | None) -> float:
+        if result.retry_after < 0:
+            raise ValueError("cost exceeds the limit, the call can never be admitted")
+        if deadline is not None and time.monotonic() + result.retry_after > deadline:
+            raise RateLimitExceed(result.retry_after)
+        return result.retry_after
+
+
+class RateLimiter(_BaseRateLimiter):
+    def __init__(
+        self,
+        redis_client=None,
+        key="rate_limiter",
+        limit=5,
+        period=3,
+        algorithm="sliding_log",
+        policies: Mapping[str, Limit] | None = None,
+    ):
+        if redis_client is None:
+            # По-умолчанию подключаемся к localhost
+            redis_client = redis.Redis(host="localhost", port=6379, db=0)
+        super().__init__(redis_client, key, limit, period, algorithm, policies)
+
+    def check(
+        self, key: str | None = None, cost: int = 1, policy: Limit | str | None = None
+    ) -> RateLimitResult:
+        return self.check_many({key or self.key: policy}, cost)
+
+    def check_many(
+        self, checks: Mapping[str, Limit | str | None], cost: int = 1
+    ) -> RateLimitResult:
+        # {ключ: политика} — атомарно: учитывается везде или нигде
+        keys, args = self._call_args(checks, cost)
+        return self._result(self._script(keys=keys, args=args))
 
-    def test(self) -> bool:
-        now = time.time()
-        pipe = self.redis.pipeline()
+    def test(
+        self, key: str | None = None, cost: int = 1, policy: Limit | str | None = None
+    ) -> bool:
+        return self.check(key, cost, policy).allowed
 
-        # Очищаем метки старше окна лимита
-        min_time = now - self.period
-        # Используем Sorted Set для хранения таймштампов запросов
-        pipe.zremrangebyscore(self.key, 0, min_time)
-        # Добавляем текущий запрос
-        pipe.zadd(self.key, {str(now): now})
-        # Получаем количество запросов за окно
-        pipe.zcard(self.key)
-        # Автоматически чистим ключ через period + 1
-        pipe.expire(self.key, self.period + 1)
-        _, _, count, _ = pipe.execute()
+    def acquire(
+        self,
+        key: str | None = None,
+        cost: int = 1,
+        policy: Limit | str | None = None,
+        timeout: float | None = None,
+    ) -> RateLimitResult:
+        return self.acquire_many({key or self.key: policy}, cost, timeout)
 
-        return count <= self.limit
+    def acquire_many(
+        self,
+        checks: Mapping[str, Limit | str | None],
+        cost: int = 1,
+        timeout: float | None = None,
+    ) -> RateLimitResult:
+        # Ждёт ровно retry_after между попытками; RateLimitExceed — если не успеть за timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not (result := self.check_many(checks, cost)).allowed:
+            time.sleep(self._next_wait(result, deadline))
+        return result
 
 
-def make_api_request(rate_limiter: RateLimiter):
-    if not rate_limiter.test():
-        raise RateLimitExceed
+class AsyncRateLimiter(_BaseRateLimiter):
+    def __init__(
+        self,
+        redis_client=None,
+        key="rate_limiter",
+        limit=5,
+        period=3,
+        algorithm="sliding_log",
+        policies: Mapping[str, Limit] | None = None,
+    ):
+        if redis_client is None:
+            redis_client = redis.asyncio.Redis(host="localhost", port=6379, db=0)
+        super().__init__(redis_client, key, limit, period, algorithm, policies)
+
+    async def check(
+        self, key: str | None = None, cost: int = 1, policy: Limit | str | None = None
+    ) -> RateLimitResult:
+        return await self.check_many({key or self.key: policy}, cost)
+
+    async def check_many(
+        self, checks: Mapping[str, Limit | str | None], cost: int = 1
+    ) -> RateLimitResult:
+        keys, args = self._call_args(checks, cost)
+        return self._result(await self._script(keys=keys, args=args))
+
+    async def test(
+        self, key: str | None = None, cost: int = 1, policy: Limit | str | None = None
+    ) -> bool:
+        return (await self.check(key, cost, policy)).allowed
+
+    async def acquire(
+        self,
+        key: str | None = None,
+        cost: int = 1,
+        policy: Limit | str | None = None,
+        timeout: float | None = None,
+    ) -> RateLimitResult:
+        return await self.acquire_many({key or self.key: policy}, cost, timeout)
+
+    async def acquire_many(
+        self,
+        checks: Mapping[str, Limit | str | None],
+        cost: int = 1,
+        timeout: float | None = None,
+    ) -> RateLimitResult:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not (result := await self.check_many(checks, cost)).allowed:
+            await asyncio.sleep(self._next_wait(result, deadline))
+        return result
+
+
+class _Lease:
+    __slots__ = (
+        "policy",
+        "refill",
+        "permits",
+        "expires",
+        "leased_at",
+        "used",
+        "started",
+        "rate",
+    )
+
+    def __init__(self, policy: Limit):
+        self.policy = policy
+        # Одна аренда ключа за раз: новая аренда держателя заменяет прошлую в хэше
+        self.refill = threading.Lock()
+        self.permits = 0  # неизрасходованный запас
+        self.expires = 0.0  # time.monotonic(), после которого запас не используется
+        self.leased_at = 0  # время аренды на сервере, мкс — нужно для возврата
+        self.used = 0  # пропущено с момента прошлой аренды
+        self.started = time.monotonic()
+        self.rate = 0.0  # EWMA пропусков в секунду
+
+
+class LeasedRateLimiter:
+    # Гибридный режим поверх RateLimiter: процесс берёт из Redis запас разрешений
+    # (размер — по своей недавней скорости за lease_ttl) и пропускает вызовы из него
+    # без сетевого запроса. Все процессы вместе держат не больше max_overshoot * limit
+    # разрешений — это и есть граница превышения глобального лимита в любом окне.
+    # При max_overshoot * limit < 1 аренды не выдаются и каждый вызов идёт в Redis.
+    # Неизрасходованное возвращается в close() (и при выходе из процесса).
+    # Общий lock защищает только локальный учёт: запрос в Redis идёт под lock ключа,
+    # и потоки с запасом по другим ключам его не ждут.
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        max_overshoot: float = DEFAULT_MAX_OVERSHOOT,
+        lease_ttl: float | None = None,
+        max_lease: int | None = None,
+    ):
+        if max_overshoot < 0:
+            raise ValueError("max_overshoot must be >= 0")
+        self.limiter = limiter
+        self.max_overshoot = max_overshoot
+        self.lease_ttl = lease_ttl
+        self.max_lease = max_lease
+        self._lease_script = limiter.redis.register_script(LEASE_LUA)
+        self._refund_script = limiter.redis.register_script(REFUND_LUA)
+        self._lock = threading.Lock()
+        self._reset()
+        # Не atexit.register(self.close): он держал бы экземпляр до выхода из процесса.
+        # Собранный без close() экземпляр ничего не возвращает — запас истечёт сам
+        weakref.finalize(self, _close_at_exit, weakref.ref(self))
+
+    def _reset(self):
+        # После fork запас родителя не наш: иначе его израсходуют дважды
+        self._pid = os.getpid()
+        self._holder = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}"
+        self._leases: dict[str, _Lease] = {}
+
+    def _want(self, lease: _Lease, budget: int, lease_ttl: float) -> int:
+        now = time.monotonic()
+        elapsed = now - lease.started
+        if elapsed > 0:
+            sample = lease.used / elapsed
+            lease.rate += LEASE_RATE_SMOOTHING * (sample - lease.rate)
+        lease.used = 0
+        lease.started = now
+        want = math.ceil(lease.rate * lease_ttl)
+        if self.max_lease is not None:
+            want = min(want, self.max_lease)
+        return min(want, budget)
+
+    def check(
+        self, key: str | None = None, cost: int = 1, policy: Limit | str | None = None
+    ) -> RateLimitResult:
+        key = key or self.limiter.key
+        _check_key(key)
+        policy = self.limiter._policy(policy)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            lease = self._leases.get(key)
+            if lease is None or lease.policy != policy:
+                lease = self._leases[key] = _Lease(policy)
+            if self._take(lease, cost):
+                return RateLimitResult(True, lease.permits, 0)
+        limit, period, algorithm = policy
+        budget = math.floor(limit * self.max_overshoot)
+        lease_ttl = self.lease_ttl or period / 10
+        with lease.refill:
+            with self._lock:
+                # Пока ждали, ключ мог пополнить другой поток
+                if self._take(lease, cost):
+                    return RateLimitResult(True, lease.permits, 0)
+                want = self._want(lease, budget, lease_ttl)
+            allowed, extra, remaining, retry_after, leased_at = self._lease_script(
+                keys=[key, _leases_key(key)],
+                args=[
+                    algorithm,
+                    limit,
+                    period,
+                    cost,
+                    want,
+                    budget,
+                    self._holder,
+                    lease_ttl,
+                ],
+            )
+            with self._lock:
+                # Остаток прошлой аренды истёк: он уже учтён в лимите и просто пропадает
+                lease.permits = extra
+                lease.expires = time.monotonic() + lease_ttl
+                lease.leased_at = leased_at
+                if allowed:
+                    lease.used += cost
+        if retry_after > 0:
+            retry_after /= 1_000_000
+        return RateLimitResult(bool(allowed), remaining + extra, retry_after)
+
+    @staticmethod
+    def _take(lease: _Lease, cost: int) -> bool:
+        if lease.permits >= cost and time.monotonic() < lease.expires:
+            lease.permits -= cost
+            lease.used += cost
+            return True
+        return False
+
+    def test(
+        self, key: str | None = None, cost: int = 1, policy: Limit | str | None = None
+    ) -> bool:
+        return self.check(key, cost, policy).allowed
+
+    def acquire(
+        self,
+        key: str | None = None,
+        cost: int = 1,
+        policy: Limit | str | None = None,
+        timeout: float | None = None,
+    ) -> RateLimitResult:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not (result := self.check(key, cost, policy)).allowed:
+            time.sleep(self.limiter._next_wait(result, deadline))
+        return result
+
+    def close(self):
+        # Вернуть неизрасходованные разрешения, чтобы их могли взять другие процессы
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            leases, self._leases = self._leases, {}
+        now = time.monotonic()
+        for key, lease in leases.items():
+            if lease.permits and now < lease.expires:
+                limit, period, algorithm = lease.policy
+                self._refund_script(
+                    keys=[key, _leases_key(key)],
+                    args=[
+                        algorithm,
+                        limit,
+                        period,
+                        lease.permits,
+                        lease.leased_at,
+                        self._holder,
+                    ],
+                )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _close_at_exit(ref: weakref.ref):
+    leased = ref()
+    if leased is not None:
+        leased.close()
+
+
+def make_api_request(rate_limiter: RateLimiter, timeout: float | None = None):
+    # Ждём своей очереди; RateLimitExceed — только если не дождались за timeout
+    rate_limiter.acquire(timeout=timeout)
+    # какая-то бизнес логика
+
+
+async def _async_selfcheck():
+    limiter = AsyncRateLimiter(
+        key="rate_limiter:selfcheck:async", limit=3, period=0.5, algorithm="gcra"
+    )
+    await limiter.redis.delete(limiter.key)
+    assert all([await limiter.test() for _ in range(3)])
+    assert not await limiter.test()
+    start = time.monotonic()
+    await limiter.acquire()
+    assert 0 < time.monotonic() - start < 0.5
+    try:
+        await limiter.acquire(timeout=0.01)
+    except RateLimitExceed as e:
+        assert e.retry_after > 0.01
     else:
-        # какая-то бизнес логика
-        pass
+        raise AssertionError("acquire() must time out")
+    await limiter.redis.delete(limiter.key)
 
 
 if __name__ == "__main__":
+    client = redis.Redis(host="localhost", port=6379, db=0)
+    for algorithm in ALGORITHMS:
+        key = f"rate_limiter:selfcheck:{algorithm}"
+        client.delete(key)
+        limiter = RateLimiter(client, key=key, limit=5, period=1, algorithm=algorithm)
+        assert all(limiter.test() for _ in range(5)), algorithm
+        denied = limiter.check()
+        assert not denied.allowed and denied.remaining == 0, (algorithm, denied)
+        # У sliding_window ожидание может доходить до двух окон
+        assert 0 < denied.retry_after <= 2, (algorithm, denied)
+        # Отклонённые запросы не расходуют лимит: после паузы запрос проходит
+        time.sleep(denied.retry_after + 0.01)
+        assert limiter.test(), algorithm
+        assert limiter.check(cost=6).retry_after == -1, algorithm
+        client.delete(key)
+
+    # Несколько ключей и тарифов одним вызовом: отказ по одному не тратит остальные
+    limiter = RateLimiter(
+        client, policies={"free": Limit(2, 60), "global": Limit(100, 60, "gcra")}
+    )
+    keys = ["rl:user:1", "rl:user:2", "rl:ip:10.0.0.1", "rl:global"]
+    client.delete(*keys)
+    checks = {
+        "rl:user:1": "free",
+        "rl:ip:10.0.0.1": Limit(3, 60),
+        "rl:global": "global",
+    }
+    assert limiter.check_many(checks).allowed
+    assert limiter.check_many(checks).remaining == 0  # user:1 исчерпал "free"
+    assert not limiter.check_many(checks).allowed
+    assert limiter.test("rl:ip:10.0.0.1", policy=Limit(3, 60))  # IP потратил только 2
+    other = {"rl:user:2": "free", "rl:ip:10.0.0.1": Limit(3, 60)}
+    assert not limiter.check_many(other).allowed  # IP исчерпан
+    assert limiter.test("rl:user:2", policy="free")  # отказ не тронул user:2
+    client.delete(*keys)
+
+    asyncio.run(_async_selfcheck())
+
+    # Аренда: большая часть вызовов без Redis, превышение не больше max_overshoot * limit
+    for algorithm in ALGORITHMS:
+        key = f"rate_limiter:selfcheck:leased:{algorithm}"
+        client.delete(key, _leases_key(key))
+        base = RateLimiter(client, key=key, limit=100, period=1, algorithm=algorithm)
+        with LeasedRateLimiter(base, max_overshoot=0.2, lease_ttl=0.5) as leased:
+            admitted = sum(leased.test() for _ in range(300))
+            assert 100 <= admitted <= 120, (algorithm, admitted)
+            assert leased._leases[key].permits <= 20
+        # Вернули запас — base видит его как свободный
+        client.delete(_leases_key(key))
+        client.delete(key)
+        with LeasedRateLimiter(base, max_overshoot=0.2, lease_ttl=0.5) as leased:
+            for _ in range(10):
+                leased.test()
+            held = leased._leases[key].permits
+            assert held > 0, algorithm
+        assert base.check(cost=90).allowed, (algorithm, held)
+        client.delete(key, _leases_key(key))
+
+    # Хэш аренд не совпадает ни с каким допустимым ключом лимита
+    try:
+        RateLimiter(client).check(_leases_key("rl:user:1"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("reserved key accepted")
+    # Экземпляр без close() собирается: финализатор не держит на него ссылку
+    leased = LeasedRateLimiter(RateLimiter(client))
+    ref = weakref.ref(leased)
+    del leased
+    assert ref() is None
+    # Поток с запасом по своему ключу не ждёт, пока другой ключ арендуется в Redis
+    base = RateLimiter(client, limit=1000, period=60, algorithm="gcra")
+    with LeasedRateLimiter(base, max_overshoot=0.5, lease_ttl=30) as leased:
+        client.delete(
+            "rl:lease:a", "rl:lease:b", *map(_leases_key, ["rl:lease:a", "rl:lease:b"])
+        )
+        for _ in range(20):
+            leased.test("rl:lease:a")
+        assert leased._leases["rl:lease:a"].permits > 0
+        leased._leases["rl:lease:b"] = _Lease(base.policy)
+        with leased._leases["rl:lease:b"].refill:  # "идёт аренда" ключа b
+            done = threading.Event()
+            threading.Thread(
+                target=lambda: leased.test("rl:lease:a") and done.set()
+            ).start()
+            assert done.wait(1)
+    client.delete("rl:lease:a", "rl:lease:b")
+
     rate_limiter = RateLimiter()
 
     for _ in range(50):
         time.sleep(random.randint(1, 2))
 
         try:
-            make_api_request(rate_limiter)
-        except RateLimitExceed:
-            print("Rate limit exceed!")
+            make_api_request(rate_limiter, timeout=1)
+        except RateLimitExceed as e:
+            print(f"Rate limit exceed! Retry after {e.retry_after:.3f}s")
         else:
             print("All good")
@@ -0,0 +1,98 @@
+# Бенчмарк RateLimiter: решений в секунду и точность при нескольких процессах на один ключ.
+#
+# Сравнивает прямую проверку в Redis на каждый вызов (sliding_log — ZSET, и gcra)
+# с LeasedRateLimiter, который пропускает большую часть вызовов из локального запаса.
+# Точность — максимум пропущенных в любом скользящем окне period относительно limit
+# и общее число пропущенных против того, что допускает сам алгоритм (больше 1.00 —
+# превышение). gcra сверх скорости допускает всплеск в limit, поэтому у него окно
+# доходит до 2.00 и без аренды. Нужен локальный redis-server.
+#
+# Запуск: uv run python redis_rate_limiter_benchmark.py
+
+
+import bisect
+import multiprocessing
+import time
+
+import redis
+
+from redis_rate_limiter import LEASES_PREFIX, LeasedRateLimiter, RateLimiter
+
+PROCESSES = 4
+DURATION = 3.0  # секунд на каждый вариант
+LIMIT = 5_000
+PERIOD = 1.0
+MAX_OVERSHOOT = 0.1
+KEY = "rate_limiter:benchmark"
+VARIANTS = [
+    ("zset", "sliding_log", False),
+    ("zset + lease", "sliding_log", True),
+    ("gcra", "gcra", False),
+    ("gcra + lease", "gcra", True),
+]
+
+
+def worker(args) -> tuple[int, list[float]]:
+    algorithm, leased, start_at = args
+    limiter = RateLimiter(key=KEY, limit=LIMIT, period=PERIOD, algorithm=algorithm)
+    if leased:
+        limiter = LeasedRateLimiter(limiter, max_overshoot=MAX_OVERSHOOT)
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = start_at + DURATION
+    decisions = 0
+    admitted = []
+    while (now := time.time()) < deadline:
+        if limiter.test():
+            admitted.append(now)
+        decisions += 1
+    if leased:
+        limiter.close()
+    return decisions, admitted
+
+
+def max_in_window(timestamps: list[float], period: float) -> int:
+    # Скользящее окно по отсортированным отметкам
+    best = 0
+    for i, start in enumerate(timestamps):
+        best = max(best, bisect.bisect_left(timestamps, start + period, i) - i)
+    return best
+
+
+def run_variant(algorithm: str, leased: bool) -> tuple[float, float, float]:
+    redis.Redis().delete(KEY, LEASES_PREFIX + KEY)
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(PROCESSES) as pool:
+        # Старт всех процессов одновременно, после запуска интерпретаторов
+        start_at = time.time() + 1.0
+        results = pool.map(worker, [(algorithm, leased, start_at)] * PROCESSES)
+    decisions = sum(count for count, _ in results)
+    admitted = sorted(t for _, stamps in results for t in stamps)
+    # Скользящее окно: limit за каждый period; ведро: ещё и начальный всплеск в limit
+    ideal = LIMIT * DURATION / PERIOD
+    if algorithm in ("token_bucket", "gcra"):
+        ideal += LIMIT
+    return (
+        decisions / DURATION,
+        max_in_window(admitted, PERIOD) / LIMIT,
+        len(admitted) / ideal,
+    )
+
+
+def main():
+    print(
+        f"{PROCESSES} processes, limit {LIMIT} per {PERIOD}s, "
+        f"max_overshoot {MAX_OVERSHOOT}, {DURATION}s per variant"
+    )
+    print(
+        "{:<14} {:>14} {:>12} {:>12}".format(
+            "Variant", "decisions/s", "max window", "admitted"
+        )
+    )
+    print("-" * 55)
+    for title, algorithm, leased in VARIANTS:
+        rate, window, total = run_variant(algorithm, leased)
+        print(f"{title:<14} {rate:>14,.0f} {window:>12.2f} {total:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,311 @@
 # Задача - Распределенный лок
 # У вас есть распределенное приложение работающее на десятках серверах.
 # Вам необходимо написать декоратор single который гарантирует, что декорируемая функция не исполняется параллельно.
+#
+# Пока функция работает, сторожевой поток (для async def — задача) продлевает лок
+# Lua-скриптом каждые ttl / 3, так что долгая функция не теряет эксклюзивность, а лок
+# упавшего процесса истекает через max_processing_time. С wait= вызов не падает сразу,
+# а ждёт освобождения: release публикует сообщение в канал лока, ожидающие слушают его
+# (и перепроверяют по истечении TTL, если держатель упал). Каждому захвату выдаётся
+# монотонно растущий fencing token: с fencing_token="имя" он передаётся функции этим
+# именованным аргументом, чтобы внешние системы могли отвергать записи устаревшего
+# держателя.
+#
+# key= строит ключ лока из аргументов вызова: вызовы с разными сущностями идут
+# параллельно. Подключение создаётся лениво — своё в каждом процессе (после fork
+# сокеты родителя не используются) и, для async, в каждом event loop. Скрипты
+# вызываются через EVALSHA; тело скрипта уходит на сервер только при NOSCRIPT.
 
+import asyncio
 import datetime
 import functools
+import inspect
+import logging
 import multiprocessing
+import os
+import threading
 import time
 import uuid
+import weakref
+from typing import Any, Callable, NamedTuple
 
 import redis
+import redis.asyncio
 
-# Подключение к Redis вне функции (один раз)
-r = redis.StrictRedis.from_url("redis://localhost:6379/0")
+REDIS_URL = "redis://localhost:6379/0"
+RENEW_FRACTION = 3  # продлеваем лок каждые ttl / RENEW_FRACTION
 
-# Скрипты на Lua в Redis выполняются атомарно, что гарантирует отсутствие гонок в проверке и удалении
+# Скрипты на Lua в Redis выполняются атомарно, что гарантирует отсутствие гонок в проверке и удалении.
+# KEYS: лок, счётчик fencing token; ARGV: id, ttl в мс, нужен ли токен ("1"/"0").
+# Возвращает {token, 0} (без токена — {1, 0}) или {0, pttl}
+ACQUIRE_LUA = """
+if redis.call('set', KEYS[1], ARGV[1], 'nx', 'px', ARGV[2]) then
+    if ARGV[3] == '1' then
+        return {redis.call('incr', KEYS[2]), 0}
+    end
+    return {1, 0}
+end
+return {0, redis.call('pttl', KEYS[1])}
+"""
+
+RENEW_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+else
+    return 0
+end
+"""
+
+# ARGV[2] — канал, в который сообщаем ожидающим об освобождении
 RELEASE_LUA = """
 if redis.call('get', KEYS[1]) == ARGV[1] then
-    return redis.call('del', KEYS[1])
+    redis.call('del', KEYS[1])
+    redis.call('publish', ARGV[2], ARGV[1])
+    return 1
 else
     return 0
 end
 """
 
 
+class _Connection(NamedTuple):
+    client: Any
+    acquire: Any
+    renew: Any
+    release: Any
+
+
+def _connect(client) -> _Connection:
+    # register_script считает sha локально и вызывает EVALSHA, загружая скрипт при NOSCRIPT
+    return _Connection(
+        client,
+        client.register_script(ACQUIRE_LUA),
+        client.register_script(RENEW_LUA),
+        client.register_script(RELEASE_LUA),
+    )
+
+
+_connection: _Connection | None = None
+_connection_pid: int | None = None
+_connection_lock = threading.Lock()
+# redis.asyncio-клиент привязан к event loop, поэтому свой на каждый loop
+_async_connections: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_connection() -> _Connection:
+    global _connection, _connection_pid
+    pid = os.getpid()
+    if _connection_pid != pid:
+        with _connection_lock:
+            if _connection_pid != pid:
+                _connection = _connect(redis.StrictRedis.from_url(REDIS_URL))
+                _connection_pid = pid
+    return _connection
+
+
+def get_async_connection() -> _Connection:
+    loop = asyncio.get_running_loop()
+    connection = _async_connections.get(loop)
+    if connection is None:
+        connection = _connect(redis.asyncio.StrictRedis.from_url(REDIS_URL))
+        _async_connections[loop] = connection
+    return connection
+
+
 class SingleExecutionError(Exception):
     """Функция уже выполняется в другом процессе/узле"""
 
     pass
 
 
-def single(max_processing_time: datetime.timedelta):
+def _seconds(value: datetime.timedelta | float | None) -> float | None:
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return value
+
+
+class _Lock:
+    # Состояние одного захвата: ключи, id владельца и ttl. Имя функции не содержит
+    # ":", поэтому ключи локов ("single:<func>[:k:<suffix>]"), счётчик токенов и канал
+    # (свои префиксы "single:fence:", "single:released:") не пересекаются при любом
+    # suffix. Счётчик один на функцию: токены монотонны и для каждого suffix, а ключей
+    # в Redis не прибавляется с каждым новым значением аргумента.
+    def __init__(
+        self, func, ttl_ms: int, suffix: str | None = None, fencing: bool = False
+    ):
+        name = f"{func.__module__}.{func.__qualname__}"
+        scope = name if suffix is None else f"{name}:k:{suffix}"
+        self.key = f"single:{scope}"
+        self.fence_key = f"single:fence:{name}"
+        self.channel = f"single:released:{scope}"
+        self.id = str(uuid.uuid4())
+        self.ttl_ms = ttl_ms
+        self.fencing = fencing
+        self.lost = False
+
+    # Для async-подключения возвращают корутину
+    def acquire(self, connection: _Connection):
+        return connection.acquire(
+            keys=[self.key, self.fence_key],
+            args=[self.id, self.ttl_ms, "1" if self.fencing else "0"],
+        )
+
+    def renew(self, connection: _Connection):
+        return connection.renew(keys=[self.key], args=[self.id, self.ttl_ms])
+
+    def release(self, connection: _Connection):
+        return connection.release(keys=[self.key], args=[self.id, self.channel])
+
+    def wait_time(self, pttl: int, deadline: float) -> float:
+        # Ждём сигнала освобождения, но не дольше TTL (держатель мог упасть) и дедлайна
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise SingleExecutionError()
+        return min(remaining, pttl / 1000) if pttl > 0 else min(remaining, 0.01)
+
+    def on_lost(self):
+        self.lost = True
+        logging.warning(
+            f"Lock {self.key} expired while the function was running, "
+            "exclusivity is no longer guaranteed"
+        )
+
+
+def _acquire(lock: _Lock, wait: float | None) -> int:
+    connection = get_connection()
+    token, pttl = lock.acquire(connection)
+    if token or wait is None:
+        return token
+    deadline = time.monotonic() + wait
+    pubsub = connection.client.pubsub(ignore_subscribe_messages=True)
+    try:
+        # Подписка до повторной попытки: иначе освобождение между ними потеряется
+        pubsub.subscribe(lock.channel)
+        while not token:
+            token, pttl = lock.acquire(connection)
+            if not token:
+                pubsub.get_message(timeout=lock.wait_time(pttl, deadline))
+        return token
+    finally:
+        pubsub.close()
+
+
+def _watchdog(lock: _Lock, stop: threading.Event):
+    connection = get_connection()
+    interval = lock.ttl_ms / 1000 / RENEW_FRACTION
+    while not stop.wait(interval):
+        try:
+            if not lock.renew(connection):
+                lock.on_lost()
+                return
+        except redis.RedisError as e:
+            # Временная ошибка: следующая попытка ещё успеет до истечения TTL
+            logging.warning(f"Failed to renew lock {lock.key}: {e}")
+
+
+async def _acquire_async(lock: _Lock, wait: float | None) -> int:
+    connection = get_async_connection()
+    token, pttl = await lock.acquire(connection)
+    if token or wait is None:
+        return token
+    deadline = time.monotonic() + wait
+    pubsub = connection.client.pubsub()
+    try:
+        await pubsub.subscribe(lock.channel)
+        while not token:
+            token, pttl = await lock.acquire(connection)
+            if not token:
+                await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=lock.wait_time(pttl, deadline),
+                )
+        return token
+    finally:
+        await pubsub.aclose()
+
+
+async def _watchdog_async(lock: _Lock):
+    connection = get_async_connection()
+    interval = lock.ttl_ms / 1000 / RENEW_FRACTION
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await lock.renew(connection):
+                lock.on_lost()
+                return
+        except redis.RedisError as e:
+            logging.warning(f"Failed to renew lock {lock.key}: {e}")
+
+
+def single(
+    max_processing_time: datetime.timedelta,
+    wait: datetime.timedelta | float | None = None,
+    renew: bool = True,
+    fencing_token: str | None = None,
+    key: Callable[..., Any] | None = None,
+):
+    # wait — сколько ждать освобождения лока (None — сразу SingleExecutionError);
+    # renew — продлевать лок, пока функция работает; fencing_token — имя аргумента
+    # функции для токена захвата; key — функция от аргументов вызова, её результат
+    # дописывается к ключу лока (по умолчанию один лок на функцию)
+    ttl_ms = int(max_processing_time.total_seconds() * 1000)
+    wait = _seconds(wait)
+    if ttl_ms <= 0:
+        raise ValueError("max_processing_time must be positive")
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                lock = _Lock(
+                    func,
+                    ttl_ms,
+                    key(*args, **kwargs) if key else None,
+                    fencing_token is not None,
+                )
+                token = await _acquire_async(lock, wait)
+                if not token:
+                    raise SingleExecutionError()
+                if fencing_token:
+                    kwargs[fencing_token] = token
+                watchdog = asyncio.create_task(_watchdog_async(lock)) if renew else None
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    if watchdog is not None:
+                        watchdog.cancel()
+                    await lock.release(get_async_connection())
+
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            lock_key = f"single:{func.__module__}.{func.__qualname__}"
-            lock_id = str(uuid.uuid4())
-            ttl = int(max_processing_time.total_seconds())
-            acquired = r.set(lock_key, lock_id, nx=True, ex=ttl)
-            if not acquired:
+            lock = _Lock(
+                func,
+                ttl_ms,
+                key(*args, **kwargs) if key else None,
+                fencing_token is not None,
+            )
+            token = _acquire(lock, wait)
+            if not token:
                 raise SingleExecutionError()
+            if fencing_token:
+                kwargs[fencing_token] = token
+            stop = threading.Event()
+            watchdog = None
+            if renew:
+                watchdog = threading.Thread(
+                    target=_watchdog, args=(lock, stop), daemon=True
+                )
+                watchdog.start()
             try:
                 return func(*args, **kwargs)
             finally:
-                r.eval(RELEASE_LUA, 1, lock_key, lock_id)
+                stop.set()
+                if watchdog is not None:
+                    watchdog.join()
+                lock.release(get_connection())
 
         return wrapper
 
@@ -64,7 +327,80 @@ def worker(instance_id: int):
         print(f"[{instance_id}] - Locked, skipping execution")
 
 
+def _job(token):
+    time.sleep(0.5)
+    return token
+
+
+async def _async_selfcheck():
+    async def job(token):
+        await asyncio.sleep(0.5)
+        return token
+
+    quick = single(datetime.timedelta(seconds=0.3), fencing_token="token")(job)
+    patient = single(datetime.timedelta(seconds=0.3), wait=3, fencing_token="token")(
+        job
+    )
+    first = asyncio.create_task(quick())
+    await asyncio.sleep(0.1)
+    try:
+        await quick()
+    except SingleExecutionError:
+        pass
+    else:
+        raise AssertionError("lock must be held")
+    assert await patient() > await first
+
+
 if __name__ == "__main__":
+    # Лок продлевается дольше max_processing_time, ожидающий получает его после
+    # освобождения, токены растут
+    quick = single(datetime.timedelta(seconds=0.3), fencing_token="token")(_job)
+    patient = single(datetime.timedelta(seconds=0.3), wait=3, fencing_token="token")(
+        _job
+    )
+    holder = threading.Thread(target=lambda: results.append(quick()))
+    results = []
+    holder.start()
+    time.sleep(0.4)  # TTL уже истёк бы без продления
+    try:
+        quick()
+    except SingleExecutionError:
+        pass
+    else:
+        raise AssertionError("lock must be held")
+    token = patient()
+    holder.join()
+    assert token > results[0]
+    asyncio.run(_async_selfcheck())
+
+    # Лок по аргументу: разные id параллельно, одинаковые — по одному
+    by_id = single(datetime.timedelta(seconds=5), key=lambda token: token)(_job)
+    threads = [threading.Thread(target=by_id, args=(i,)) for i in range(3)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start < 1.0
+    holder = threading.Thread(target=by_id, args=(7,))
+    holder.start()
+    time.sleep(0.1)
+    try:
+        by_id(7)
+    except SingleExecutionError:
+        pass
+    else:
+        raise AssertionError("same key must be locked")
+    holder.join()
+    # Без fencing_token ничего не остаётся в Redis, suffix не задевает чужие ключи
+    client = get_connection().client
+    before = set(client.keys("single:*"))
+    by_id(42)
+    by_id("42:fence")
+    by_id("42:released")
+    assert set(client.keys("single:*")) == before
+
     # Запускаем несколько процессов параллельно, чтобы проверить блокировку
     process_count = 5
     with multiprocessing.Pool(process_count) as pool: